@@ -22,7 +22,7 @@ from os import path
 import shutil
 import sys
 
-from nototools import unicode_data
+import unicode_snapshot as unicode_data
 
 """Create aliases in target directory.
 
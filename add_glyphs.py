@@ -1,11 +1,15 @@
 #!/usr/bin/env python3
 
-"""Extend a ttx file with additional data.
+"""Extend a font with additional data.
 
-Takes a ttx file and one or more directories containing image files named
+Takes a font and one or more directories containing image files named
 after sequences of codepoints, extends the cmap, hmtx, GSUB, and GlyphOrder
-tables in the source ttx file based on these sequences, and writes out a new
-ttx file.
+tables in the source font based on these sequences, and writes out a new
+font.
+
+Fonts whose names end in '.ttx' or '.ttx.tmpl' are read and written as ttx
+XML, other names as binary fonts.  Writing the binary font directly avoids
+an XML round trip through ttx, so ttx output is mainly useful for debugging.
 
 This can also apply aliases from an alias file."""
 
@@ -27,7 +31,7 @@ import add_aliases
 
 sys.path.append(
     path.join(os.path.dirname(__file__), 'third_party', 'color_emoji'))
-from png import PNG
+from png_index import PNGIndex
 
 
 def get_seq_to_file(image_dir, prefix, suffix):
@@ -72,9 +76,11 @@ def remap_values(seq_to_file, map_fn):
   return {k: map_fn(v) for k, v in seq_to_file.items()}
 
 
-def get_png_file_to_advance_mapper(lineheight):
+def get_png_file_to_advance_mapper(lineheight, png_index=None):
+  if png_index is None:
+    png_index = PNGIndex()
   def map_fn(filename):
-    wid, ht = PNG(filename).get_size()
+    wid, ht = png_index.get_size(filename)
     return int(round(float(lineheight) * wid / ht))
   return map_fn
 
@@ -130,6 +136,10 @@ def get_all_seqs(font, seq_to_advance):
   glyphOrder = font.getGlyphOrder()
   # extract cps in glyphOrder and reduce glyphOrder to only those that remain
   glyphOrder_cps = get_glyphorder_cps_and_truncate(glyphOrder)
+  # a font loaded from a binary file might already have built its reverse
+  # glyph map, which is now stale.
+  if hasattr(font, '_reverseGlyphOrderDict'):
+    delattr(font, '_reverseGlyphOrderDict')
   cps.update(glyphOrder_cps)
   # add new single codepoint sequences from glyphOrder and sequences
   all_seqs.update((cp,) for cp in cps)
@@ -380,7 +390,33 @@ def apply_aliases(seq_dict, aliases):
   return usable_aliases
 
 
-def update_ttx(in_file, out_file, image_dirs, prefix, ext, aliases_file, add_cmap4, add_glyf):
+def is_ttx_file(filename):
+  return filename.endswith('.ttx') or filename.endswith('.ttx.tmpl')
+
+
+def load_font(in_file):
+  """Load a ttx or binary font.  Binary fonts are fully decompiled, since
+  get_all_seqs rewrites the glyph order in place."""
+  if is_ttx_file(in_file):
+    font = ttx.TTFont()
+    font.importXML(in_file)
+  else:
+    font = ttx.TTFont(in_file)
+    for tag in font.keys():
+      font[tag]
+  return font
+
+
+def save_font(font, out_file):
+  if is_ttx_file(out_file):
+    font.saveXML(out_file)
+  else:
+    font.save(out_file)
+
+
+def update_font_file(
+    in_file, out_file, image_dirs, prefix, ext, aliases_file, add_cmap4,
+    add_glyf, png_index_file=None):
   if ext != '.png':
     raise Exception('extension "%s" not supported' % ext)
 
@@ -395,26 +431,29 @@ def update_ttx(in_file, out_file, image_dirs, prefix, ext, aliases_file, add_cma
     aliases = add_aliases.read_emoji_aliases(aliases_file)
     aliases = apply_aliases(seq_to_file, aliases)
 
-  font = ttx.TTFont()
-  font.importXML(in_file)
+  font = load_font(in_file)
 
   lineheight = font['hhea'].ascent - font['hhea'].descent
-  map_fn = get_png_file_to_advance_mapper(lineheight)
+  png_index = PNGIndex(png_index_file)
+  map_fn = get_png_file_to_advance_mapper(lineheight, png_index)
   seq_to_advance = remap_values(seq_to_file, map_fn)
+  png_index.save()
 
   vadvance = font['vhea'].advanceHeightMax if 'vhea' in font else lineheight
 
   update_font_data(font, seq_to_advance, vadvance, aliases, add_cmap4, add_glyf)
 
-  font.saveXML(out_file)
+  save_font(font, out_file)
 
 
 def main():
   parser = argparse.ArgumentParser()
   parser.add_argument(
-      '-f', '--in_file', help='ttx input file', metavar='file', required=True)
+      '-f', '--in_file', help='input font, ttx if the name ends in .ttx or '
+      '.ttx.tmpl, else binary', metavar='file', required=True)
   parser.add_argument(
-      '-o', '--out_file', help='ttx output file', metavar='file', required=True)
+      '-o', '--out_file', help='output font, ttx if the name ends in .ttx, '
+      'else binary', metavar='file', required=True)
   parser.add_argument(
       '-d', '--image_dirs', help='directories containing image files',
       nargs='+', metavar='dir', required=True)
@@ -431,11 +470,14 @@ def main():
       '--add_cmap4', help='add cmap format 4 table', dest='add_cmap4', action='store_true')
   parser.add_argument(
       '--add_glyf', help='add glyf and loca tables', dest='add_glyf', action='store_true')
+  parser.add_argument(
+      '--png_index', help='file to cache png header data in between builds',
+      metavar='file')
   args = parser.parse_args()
 
-  update_ttx(
+  update_font_file(
       args.in_file, args.out_file, args.image_dirs, args.prefix, args.ext,
-      args.aliases, args.add_cmap4, args.add_glyf)
+      args.aliases, args.add_cmap4, args.add_glyf, args.png_index)
 
 
 if __name__ == '__main__':
@@ -43,6 +43,9 @@ class FontBuilder(object):
   def __init__(self, font):
     self.font = font;
     self.glyph_order = font.getGlyphOrder()
+    # name to index map, kept in sync with glyph_order by _add_empty_glyph
+    self.glyph_indices = {
+        name: index for index, name in enumerate(self.glyph_order)}
     self.cmap = font['cmap'].tables[0].cmap
     self.hmtx = font['hmtx'].metrics
 
@@ -107,7 +110,7 @@ class FontBuilder(object):
     return "_".join(["u%04X" % ord(char) for char in string])
 
   def glyph_name_to_index(self, name):
-    return self.glyph_order.index(name) if name in self.glyph_order else -1;
+    return self.glyph_indices.get(name, -1)
 
   def glyph_index_to_name(self, glyph_index):
     if glyph_index < len(self.glyph_order):
@@ -115,7 +118,7 @@ class FontBuilder(object):
     return ''
 
   def have_glyph(self, name):
-    return self.name_to_glyph_index >= 0
+    return name in self.glyph_indices
 
   def _add_ligature(self, glyphstr):
     lig = otTables.Ligature()
@@ -135,6 +138,7 @@ class FontBuilder(object):
     if len(glyphstr) == 1:
       self.cmap[ord(glyphstr)] = name
     self.hmtx[name] = [0, 0]
+    self.glyph_indices[name] = len(self.glyph_order)
     self.glyph_order.append(name)
     if hasattr(self, 'glyphs'):
       self.glyphs[name] = _g_l_y_f.Glyph()
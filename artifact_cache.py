@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+
+"""Content-addressed cache for the outputs of the image pipeline.
+
+Outputs are stored under a key made from the stage name, the flags that
+affect the output, the sha256 of the input file and the code the stage
+runs, so they survive a make clean or a fresh checkout, and can be shared
+between machines that use the same cache directory.  The code is
+identified by the sha256 of the stage's scripts or executables and the
+versions of the python packages it uses, so updating any of them misses
+the old entries.
+
+As a command it wraps one pipeline step:
+
+  artifact_cache.py -c DIR -s STAGE -k FLAGS [-t TOOL...] [-p PACKAGE...] \
+      -i INPUT -o OUTPUT -- CMD...
+
+TOOL defaults to CMD's executable.  If the cache has an entry for the key,
+it is copied to OUTPUT and CMD is not run.  Otherwise CMD is run, and
+OUTPUT is stored if CMD succeeds."""
+
+import argparse
+import hashlib
+import importlib.metadata
+import os
+from os import path
+import shutil
+import subprocess
+import sys
+
+
+# Bump this to invalidate every entry when the key format changes.
+_KEY_VERSION = 2
+
+
+def file_digest(filename):
+    h = hashlib.sha256()
+    with open(filename, "rb") as f:
+        for block in iter(lambda: f.read(1 << 16), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def tool_key(files=(), packages=()):
+    """Return a string identifying the code a stage runs: the sha256 of each
+    of files, which are scripts or executables (looked up on the PATH when
+    they are bare names), and the installed version of each of packages."""
+    parts = []
+    for filename in files:
+        found = filename if os.sep in filename else shutil.which(filename)
+        if found and path.isfile(found):
+            digest = file_digest(found)
+        else:
+            digest = "missing"
+        parts.append("%s=%s" % (path.basename(filename), digest))
+    for package in packages:
+        try:
+            version = importlib.metadata.version(package)
+        except importlib.metadata.PackageNotFoundError:
+            version = "missing"
+        parts.append("%s==%s" % (package, version))
+    return " ".join(parts)
+
+
+class ArtifactCache:
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+
+    def key(self, stage, flags, input_file, tool=""):
+        """Return the key for the output of stage run with flags (a string)
+        on input_file, by the code identified by tool (see tool_key)."""
+        h = hashlib.sha256()
+        for part in (
+            str(_KEY_VERSION), stage, flags, tool, file_digest(input_file)
+        ):
+            h.update(part.encode("utf-8"))
+            h.update(b"\0")
+        return h.hexdigest()
+
+    def entry(self, key):
+        return path.join(self.cache_dir, key[:2], key)
+
+    def get(self, key, out_file):
+        """Copy the entry for key to out_file.  Return False if there is none."""
+        try:
+            shutil.copyfile(self.entry(key), out_file)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def put(self, key, out_file):
+        """Store out_file as the entry for key."""
+        entry = self.entry(key)
+        os.makedirs(path.dirname(entry), exist_ok=True)
+        # write to a temporary name so concurrent builds never see a partial
+        # entry
+        tmp_file = "%s.%d.tmp" % (entry, os.getpid())
+        shutil.copyfile(out_file, tmp_file)
+        os.replace(tmp_file, entry)
+
+
+def run_cached(cache, stage, flags, input_file, out_file, cmd, tool=""):
+    """Produce out_file from the cache, or by running cmd and caching its
+    output.  Return the exit status of cmd, or 0 on a cache hit."""
+    key = cache.key(stage, flags, input_file, tool)
+    if cache.get(key, out_file):
+        return 0
+    status = subprocess.call(cmd)
+    if status == 0:
+        if not path.exists(out_file):
+            raise ValueError("%s did not write %s" % (cmd[0], out_file))
+        cache.put(key, out_file)
+    return status
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-c", "--cache_dir", help="cache directory", metavar="dir", required=True
+    )
+    parser.add_argument(
+        "-s", "--stage", help="name of the pipeline stage", metavar="name",
+        required=True,
+    )
+    parser.add_argument(
+        "-k", "--flags", help="flags that affect the output", metavar="flags",
+        default="",
+    )
+    parser.add_argument(
+        "-t", "--tools", help="scripts or executables the stage runs "
+        "(default: the executable of cmd)", metavar="file", nargs="*",
+    )
+    parser.add_argument(
+        "-p", "--packages", help="python packages the stage uses",
+        metavar="name", nargs="*", default=[],
+    )
+    parser.add_argument(
+        "-i", "--input", help="input file", metavar="file", required=True
+    )
+    parser.add_argument(
+        "-o", "--output", help="output file", metavar="file", required=True
+    )
+    parser.add_argument(
+        "cmd", help="command that writes the output", metavar="cmd", nargs="+"
+    )
+    args = parser.parse_args()
+    tools = args.tools if args.tools is not None else args.cmd[:1]
+
+    sys.exit(
+        run_cached(
+            ArtifactCache(args.cache_dir),
+            args.stage,
+            args.flags,
+            args.input,
+            args.output,
+            args.cmd,
+            tool_key(tools, args.packages),
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+
+"""Build the CBDT emoji fonts in a single process.
+
+This does what the Makefile used to do with a chain of scripts: add_glyphs,
+emoji_builder, map_pua_emoji and nototools' add_vs_cmap.  Each of those
+loaded the font from disk and saved it again.  Here every font is kept in
+memory from the template to the final save, and NotoColorEmoji and the
+WindowsCompatible variant share the image sizes and the filtered PNG data,
+so each image is only read once.  The time spent in each stage is reported
+at the end."""
+
+import argparse
+import contextlib
+import os
+import sys
+import tempfile
+import time
+
+from nototools import add_vs_cmap
+from nototools import font_data
+from nototools import unicode_data
+
+import add_aliases
+import add_glyphs
+import map_pua_emoji
+
+# add_glyphs puts third_party/color_emoji on the path
+import emoji_builder
+from font_splice import save_with_table
+from png_index import PNGIndex
+
+
+# CBDT build step: @$(VS_ADDER) -vs 2640 2642 2695
+_VS_ADDED = {0x2640, 0x2642, 0x2695}
+
+# The unknown flag glyph, removed from the cmap once the strikes are built.
+_UNKNOWN_FLAG_PUA = 0xFE82B
+
+
+class StageTimer:
+    """Accumulates the wall time spent in each named stage."""
+
+    def __init__(self):
+        self.times = {}
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.times[name] = self.times.get(name, 0) + time.time() - start
+
+    def report(self, out=sys.stdout):
+        width = max(len(name) for name in self.times)
+        for name, seconds in self.times.items():
+            print("%-*s %7.2fs" % (width, name, seconds), file=out)
+        print("%-*s %7.2fs" % (width, "total", sum(self.times.values())), file=out)
+
+
+class SharedInputs:
+    """The inputs that do not depend on the font variant: the image files,
+    their advances, the aliases, the emoji variation sequence data and, if
+    share_records is set, the filtered PNG records.  Sharing the records
+    saves reading the images again for the second font, at the cost of
+    keeping them all in memory."""
+
+    def __init__(
+        self, lineheight, image_dirs, prefix, aliases_file, png_index, share_records
+    ):
+        seq_to_file = add_glyphs.collect_seq_to_file(image_dirs, prefix, ".png")
+        if not seq_to_file:
+            raise ValueError(
+                'no sequences with prefix "%s" in %s' % (prefix, ", ".join(image_dirs))
+            )
+        self.aliases = None
+        if aliases_file:
+            aliases = add_aliases.read_emoji_aliases(aliases_file)
+            self.aliases = add_glyphs.apply_aliases(seq_to_file, aliases)
+
+        map_fn = add_glyphs.get_png_file_to_advance_mapper(lineheight, png_index)
+        self.seq_to_advance = add_glyphs.remap_values(seq_to_file, map_fn)
+
+        self.png_index = png_index
+        self.records = {} if share_records else None
+        self.emoji_variants = unicode_data.get_unicode_emoji_variants() | _VS_ADDED
+
+
+def build_font(
+    template,
+    out_file,
+    img_prefix,
+    shared,
+    timer,
+    options,
+    add_cmap4,
+    add_glyf,
+    font=None,
+):
+    """Build one CBDT font from the ttx template and write it to out_file.
+    font, if given, is the template already loaded, which is changed."""
+    name = out_file
+    if font is None:
+        with timer.stage("%s: load template" % name):
+            font = add_glyphs.load_font(template)
+
+    with timer.stage("%s: add glyphs" % name):
+        lineheight = font["hhea"].ascent - font["hhea"].descent
+        vadvance = font["vhea"].advanceHeightMax if "vhea" in font else lineheight
+        add_glyphs.update_font_data(
+            font, shared.seq_to_advance, vadvance, shared.aliases, add_cmap4, add_glyf
+        )
+
+    # The CBDT table goes to a temporary file and is copied into the font
+    # when it is saved.
+    out_dir = os.path.dirname(os.path.abspath(out_file))
+    with tempfile.TemporaryFile(dir=out_dir) as cbdt_file:
+        with timer.stage("%s: add strikes" % name):
+            emoji_builder.add_strikes(
+                font,
+                [img_prefix],
+                options,
+                shared.png_index,
+                shared.records,
+                cbdt_file,
+            )
+            if "keep_outlines" not in options:
+                emoji_builder.drop_outline_tables(font)
+            # Removing the entry any earlier breaks glyph id lookups, see
+            # emoji_builder.main.
+            font_data.delete_from_cmap(font, [_UNKNOWN_FLAG_PUA])
+
+        with timer.stage("%s: add pua cmap" % name):
+            map_pua_emoji.add_pua_cmap_to_font(font)
+
+        with timer.stage("%s: add vs cmap" % name):
+            if font_data.get_variation_sequence_cmap(font):
+                raise ValueError("font %s already has a format 14 cmap" % name)
+            add_vs_cmap.modify_font(name, font, "emoji", shared.emoji_variants)
+
+        with timer.stage("%s: save" % name):
+            save_with_table(font, "CBDT", cbdt_file, out_file)
+
+
+def build_fonts(
+    template,
+    image_dir,
+    out_file=None,
+    windows_out_file=None,
+    prefix="emoji_u",
+    aliases_file=None,
+    png_index_file=None,
+    options=(),
+):
+    """Build NotoColorEmoji into out_file and the WindowsCompatible variant,
+    which keeps the outline tables and adds a format 4 cmap and glyf table,
+    into windows_out_file.  Either may be None to skip that font."""
+    timer = StageTimer()
+    png_index = PNGIndex(png_index_file)
+    # The first font built uses this copy of the template.
+    with timer.stage("load template"):
+        font = add_glyphs.load_font(template)
+    with timer.stage("shared inputs"):
+        lineheight = font["hhea"].ascent - font["hhea"].descent
+        shared = SharedInputs(
+            lineheight,
+            [image_dir],
+            prefix,
+            aliases_file,
+            png_index,
+            bool(out_file and windows_out_file),
+        )
+
+    img_prefix = "%s/%s" % (image_dir, prefix)
+    if out_file:
+        build_font(
+            template, out_file, img_prefix, shared, timer, options, False, False, font
+        )
+        font = None
+    if windows_out_file:
+        build_font(
+            template,
+            windows_out_file,
+            img_prefix,
+            shared,
+            timer,
+            list(options) + ["keep_outlines"],
+            True,
+            True,
+            font,
+        )
+    png_index.save()
+
+    print()
+    timer.report()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-t",
+        "--template",
+        help="ttx font template (default NotoColorEmoji.tmpl.ttx.tmpl)",
+        metavar="file",
+        default="NotoColorEmoji.tmpl.ttx.tmpl",
+    )
+    parser.add_argument(
+        "-d", "--image_dir", help="directory of emoji images", metavar="dir", required=True
+    )
+    parser.add_argument(
+        "-p", "--prefix", help='file prefix (default "emoji_u")', metavar="pfx",
+        default="emoji_u",
+    )
+    parser.add_argument(
+        "-a", "--aliases", help="alias table", metavar="file",
+    )
+    parser.add_argument(
+        "-o", "--out_file", help="output NotoColorEmoji font", metavar="file"
+    )
+    parser.add_argument(
+        "-w",
+        "--windows_out_file",
+        help="output NotoColorEmoji_WindowsCompatible font",
+        metavar="file",
+    )
+    parser.add_argument(
+        "--png_index",
+        help="file to cache png header data in between builds",
+        metavar="file",
+    )
+    parser.add_argument(
+        "-S", "--small_metrics", help="store images with small glyph metrics",
+        action="store_true",
+    )
+    parser.add_argument(
+        "-P", "--parallel", help="load the images in a process pool",
+        action="store_true",
+    )
+    parser.add_argument(
+        "-D", "--dedup", help="store identical images only once",
+        action="store_true",
+    )
+    parser.add_argument(
+        "-V", "--verbose", help="verbose emoji_builder output", action="store_true"
+    )
+    args = parser.parse_args()
+    if not args.out_file and not args.windows_out_file:
+        parser.error("nothing to build, give -o and/or -w")
+
+    options = []
+    if args.small_metrics:
+        options.append("small_glyph_metrics")
+    if args.parallel:
+        options.append("parallel")
+    if args.dedup:
+        options.append("dedup")
+    if args.verbose:
+        options.append("verbose")
+
+    build_fonts(
+        args.template,
+        args.image_dir,
+        args.out_file,
+        args.windows_out_file,
+        args.prefix,
+        args.aliases,
+        args.png_index,
+        options,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+
+"""Run the python build tools in a server that keeps them loaded.
+
+Each tool started by the Makefile or full_rebuild.sh imports fontTools and
+nototools, loads the unicode data and reads the same templates and alias
+table again, which takes longer than most of the steps themselves.  The
+server does all that once:
+
+  build_server.py serve -s SOCKET [-t TEMPLATE...] [-a ALIASES...]
+
+and runs the tools for clients on a unix socket:
+
+  build_server.py run [-s SOCKET] -- TOOL.py ARGS...
+
+Every request is run in a process forked from the server, so a tool sees
+the loaded modules and data but cannot change them for the next request.
+The client hands its stdin, stdout and stderr to the tool, which runs in
+the client's directory and environment, and exits with the tool's exit
+status.  If there is no server, or it does not have the tool, the client
+runs the tool itself, so the command line works either way.  The socket
+defaults to $BUILD_SERVER_SOCKET.
+
+The tools are imported when the server starts, so it has to be restarted
+to pick up changes to them."""
+
+import argparse
+import json
+import os
+from os import path
+import socket
+import sys
+
+
+# The tools the server runs, by script name: the module with their main,
+# and whether main takes argv rather than reading sys.argv.
+_TOOLS = {
+    "add_glyphs.py": ("add_glyphs", False),
+    "build_cbdt.py": ("build_cbdt", False),
+    "check_emoji_sequences.py": ("check_emoji_sequences", False),
+    "colrv1_postproc.py": ("colrv1_postproc", True),
+    "emoji_builder.py": ("emoji_builder", True),
+    "flag_glyph_name.py": ("flag_glyph_name", False),
+    "map_pua_emoji.py": ("map_pua_emoji", True),
+    "update_flag_name.py": ("update_flag_name", True),
+}
+
+_ROOT = path.dirname(path.abspath(__file__))
+
+
+def _file_key(filename):
+    try:
+        st = os.stat(filename)
+    except OSError:
+        return None
+    return (path.abspath(filename), st.st_mtime_ns, st.st_size)
+
+
+def _install_caches(templates, alias_files):
+    """Load the templates and alias tables, and have add_glyphs.load_font
+    and add_aliases.read_emoji_aliases return copies of them while the
+    files are unchanged."""
+    import contextlib
+    import copy
+    import io
+
+    import add_aliases
+    import add_glyphs
+
+    fonts = {}
+    for filename in templates:
+        fonts[_file_key(filename)] = add_glyphs.load_font(filename)
+
+    load_font = add_glyphs.load_font
+
+    def cached_load_font(in_file):
+        font = fonts.get(_file_key(in_file))
+        if font is None:
+            return load_font(in_file)
+        return copy.deepcopy(font)
+
+    add_glyphs.load_font = cached_load_font
+
+    # read_emoji_aliases reports the lines it cannot parse, so the report
+    # is kept with the table and repeated.
+    aliases = {}
+    for filename in alias_files:
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            table = add_aliases.read_emoji_aliases(filename)
+        aliases[_file_key(filename)] = (table, out.getvalue())
+
+    read_emoji_aliases = add_aliases.read_emoji_aliases
+
+    def cached_read_emoji_aliases(filename):
+        cached = aliases.get(_file_key(filename))
+        if cached is None:
+            return read_emoji_aliases(filename)
+        table, report = cached
+        sys.stdout.write(report)
+        return dict(table)
+
+    add_aliases.read_emoji_aliases = cached_read_emoji_aliases
+
+
+def load_tools(templates=(), alias_files=()):
+    """Import the tools and load the data they share.  Return the names of
+    the tools that could be imported, which are the ones the server runs."""
+    import importlib
+
+    sys.path[:0] = [_ROOT, path.join(_ROOT, "third_party", "color_emoji")]
+
+    from nototools import unicode_data
+
+    # primes the emoji data from the snapshot if there is one
+    import unicode_snapshot
+
+    unicode_data.load_data()
+    unicode_data._load_emoji_group_data()
+
+    tools = {}
+    for script, (module_name, takes_argv) in _TOOLS.items():
+        try:
+            module = importlib.import_module(module_name)
+        except ImportError as e:
+            print("build_server: not serving %s: %s" % (script, e), file=sys.stderr)
+            continue
+        tools[script] = (module.main, takes_argv)
+
+    _install_caches(templates, alias_files)
+    return tools
+
+
+def _run_tool(main, takes_argv, argv):
+    """Run a tool's main like python would run the script, and return the
+    exit status."""
+    import traceback
+
+    sys.argv = argv
+    try:
+        if takes_argv:
+            main(argv)
+        else:
+            main()
+        status = 0
+    except SystemExit as e:
+        if e.code is None:
+            status = 0
+        elif isinstance(e.code, int):
+            status = e.code
+        else:
+            print(e.code, file=sys.stderr)
+            status = 1
+    except BaseException:
+        traceback.print_exc()
+        status = 1
+    sys.stdout.flush()
+    sys.stderr.flush()
+    return status
+
+
+def serve(socket_file, templates=(), alias_files=()):
+    import signal
+    import socketserver
+
+    tools = load_tools(templates, alias_files)
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            # The client's stdin, stdout and stderr come with the first byte.
+            _, fds, _, _ = socket.recv_fds(self.request, 1, 3)
+            request = json.loads(self.rfile.readline())
+            tool = tools.get(path.basename(request["argv"][0]))
+            if tool is None or len(fds) != 3:
+                self._reply({"error": "unavailable"})
+                return
+
+            sys.stdout.flush()
+            sys.stderr.flush()
+            for fd, std_fd in zip(fds, (0, 1, 2)):
+                os.dup2(fd, std_fd)
+                os.close(fd)
+            os.chdir(request["cwd"])
+            os.environ.clear()
+            os.environ.update(request["env"])
+            status = _run_tool(tool[0], tool[1], request["argv"])
+            self._reply({"exit": status})
+
+        def _reply(self, reply):
+            self.wfile.write(json.dumps(reply).encode("utf-8") + b"\n")
+
+    class Server(socketserver.ForkingMixIn, socketserver.UnixStreamServer):
+        pass
+
+    if path.exists(socket_file):
+        os.unlink(socket_file)
+    server = Server(socket_file, Handler)
+    os.chmod(socket_file, 0o600)
+
+    def stop(signum, frame):
+        raise KeyboardInterrupt
+
+    signal.signal(signal.SIGTERM, stop)
+    print(
+        "build_server: serving %d tools on %s" % (len(tools), socket_file),
+        file=sys.stderr,
+    )
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.unlink(socket_file)
+
+
+def _request(socket_file, argv):
+    """Have the server run argv.  Return its reply, or None if there is no
+    server."""
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_file)
+    except OSError:
+        sock.close()
+        return None
+    with sock:
+        request = {"argv": argv, "cwd": os.getcwd(), "env": dict(os.environ)}
+        socket.send_fds(sock, [b"R"], [0, 1, 2])
+        sock.sendall(json.dumps(request).encode("utf-8") + b"\n")
+        with sock.makefile("rb") as f:
+            line = f.readline()
+    if not line:
+        sys.exit("build_server: the server did not finish %s" % argv[0])
+    return json.loads(line)
+
+
+def run(socket_file, argv):
+    """Run the tool in argv in the server, or here if that is not possible.
+    Does not return."""
+    if socket_file:
+        reply = _request(socket_file, argv)
+        if reply is not None and "exit" in reply:
+            sys.exit(reply["exit"])
+    os.execv(sys.executable, [sys.executable] + argv)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run the build tools in a server that keeps them loaded."
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    serve_parser = subparsers.add_parser("serve", help="start the server")
+    serve_parser.add_argument(
+        "-s", "--socket", help="unix socket to listen on", metavar="file",
+        default=os.environ.get("BUILD_SERVER_SOCKET"),
+    )
+    serve_parser.add_argument(
+        "-t", "--templates", help="font templates to keep loaded",
+        metavar="file", nargs="*", default=[],
+    )
+    serve_parser.add_argument(
+        "-a", "--aliases", help="alias tables to keep loaded", metavar="file",
+        nargs="*", default=[],
+    )
+
+    run_parser = subparsers.add_parser(
+        "run", help="run a tool in the server, or here if there is none"
+    )
+    run_parser.add_argument(
+        "-s", "--socket", help="unix socket of the server", metavar="file",
+        default=os.environ.get("BUILD_SERVER_SOCKET"),
+    )
+    run_parser.add_argument("argv", help="tool script and its arguments", nargs="+")
+
+    args = parser.parse_args()
+    if args.command == "serve":
+        if not args.socket:
+            parser.error("no socket, give -s or set BUILD_SERVER_SOCKET")
+        serve(args.socket, args.templates, args.aliases)
+    else:
+        run(args.socket, args.argv)
+
+
+if __name__ == "__main__":
+    main()
@@ -23,13 +23,15 @@ from __future__ import print_function
 
 import argparse
 import collections
+import contextlib
 import glob
+import json
 import os
 from os import path
 import re
 import sys
 
-from nototools import unicode_data
+import unicode_snapshot as unicode_data
 import add_aliases
 
 ZWJ = 0x200d
@@ -46,52 +48,38 @@ def _make_tag_set():
 
 TAG_SET = _make_tag_set()
 
-_namedata = None
-
 def seq_name(seq):
-  global _namedata
-
-  if not _namedata:
-    def strip_vs_map(seq_map):
-      return {
-          unicode_data.strip_emoji_vs(k): v
-          for k, v in seq_map.items()}
-    _namedata = [
-        strip_vs_map(unicode_data.get_emoji_combining_sequences()),
-        strip_vs_map(unicode_data.get_emoji_flag_sequences()),
-        strip_vs_map(unicode_data.get_emoji_modifier_sequences()),
-        strip_vs_map(unicode_data.get_emoji_zwj_sequences()),
-        ]
-
   if len(seq) == 1:
     return unicode_data.name(seq[0], None)
 
-  for data in _namedata:
-    if seq in data:
-      return data[seq]
-  if EMOJI_VS in seq:
-    non_vs_seq = unicode_data.strip_emoji_vs(seq)
-    for data in _namedata:
-      if non_vs_seq in data:
-        return data[non_vs_seq]
+  return unicode_data.get_sequence_names().get(unicode_data.strip_emoji_vs(seq))
 
-  return None
 
+# Codepoint property bits, looked up once for every codepoint used in the
+# sequences being checked.
+_EMOJI = 1
+_MODIFIER_BASE = 2
+_REGIONAL_INDICATOR = 4
+_SKINTONE = 8
+_TAG = 16
+_VALID = 32  # allowed in our sequences, see _valid_emoji_cps
 
-def _check_no_vs(sorted_seq_to_filepath):
-  """Our image data does not use emoji presentation variation selectors."""
-  for seq, fp in sorted_seq_to_filepath.items():
-    if EMOJI_VS in seq:
-      print(f'check no VS: {EMOJI_VS} in path: {fp}')
+# The checks, in the order their diagnostics are reported.
+CHECKS = (
+    'no_vs', 'valid_emoji_cps', 'zwj', 'flags', 'tags', 'skintone',
+    'zwj_sequences', 'no_alias_sources', 'coverage')
 
+BLACK_FLAG = 0x1f3f4
 
-def _check_valid_emoji_cps(sorted_seq_to_filepath, unicode_version):
-  """Ensure all cps in these sequences are valid emoji cps or specific cps
-  used in forming emoji sequences.  This is a 'pre-check' that reports
-  this specific problem."""
+# A problem found by a check.  Checks whose diagnostics are fatal stop the
+# build.  The text output writes message to stderr if to_stderr is set.
+Diagnostic = collections.namedtuple(
+    'Diagnostic', 'check message path fatal to_stderr')
 
-  coverage_pass = True
 
+def _valid_emoji_cps(unicode_version):
+  """Return the valid emoji cps and the specific cps used in forming emoji
+  sequences."""
   valid_cps = set(unicode_data.get_emoji())
   if unicode_version is None or unicode_version >= unicode_data.PROPOSED_EMOJI_AGE:
     valid_cps |= unicode_data.proposed_emoji_cps()
@@ -103,158 +91,189 @@ def _check_valid_emoji_cps(sorted_seq_to_filepath, unicode_version):
   valid_cps.add(0xfe0f)  # variation selector (emoji presentation)
   valid_cps.add(0xfe82b)  # PUA value for unknown flag
   valid_cps |= TAG_SET  # used in subregion tag sequences
-
-  not_emoji = {}
-  for seq, fp in sorted_seq_to_filepath.items():
-    for cp in seq:
-      if cp not in valid_cps:
-        if cp not in not_emoji:
-          not_emoji[cp] = []
-        not_emoji[cp].append(fp)
-
-  if len(not_emoji):
-    print(
-        f'check valid emoji cps: {len(not_emoji)} non-emoji cp found', file=sys.stderr)
-    for cp in sorted(not_emoji):
-      fps = not_emoji[cp]
-      print(
-          f'check the following cp: {cp} - {not_emoji.get(cp)[0]} (in {len(fps)} sequences)', file=sys.stderr)
-    coverage_pass = False
-
-  if not coverage_pass:
-    exit("Please fix the problems mentioned above or run: make BYPASS_SEQUENCE_CHECK='True'")
-
-
-def _check_zwj(sorted_seq_to_filepath):
-  """Ensure zwj is only between two appropriate emoji.  This is a 'pre-check'
-  that reports this specific problem."""
-
-  for seq, fp in sorted_seq_to_filepath.items():
-    if ZWJ not in seq:
-      continue
-    if seq[0] == ZWJ:
-      print(f'check zwj: zwj at head of sequence in {fp}', file=sys.stderr)
-    if len(seq) == 1:
-      continue
-    if seq[-1] == ZWJ:
-      print(f'check zwj: zwj at end of sequence in {fp}', file=sys.stderr)
-    for i, cp in enumerate(seq):
-      if cp == ZWJ:
-        if i > 0:
-          pcp = seq[i-1]
-          if pcp != EMOJI_VS and not unicode_data.is_emoji(pcp):
-            print(
-                f'check zwj: non-emoji {pcp} precedes ZWJ in {fp}',
-                file=sys.stderr)
-        if i < len(seq) - 1:
-          fcp = seq[i+1]
-          if not unicode_data.is_emoji(fcp):
-            print(
-                f'check zwj: non-emoji {fcp} follows ZWJ in {fp}',
-                file=sys.stderr)
-
-
-def _check_flags(sorted_seq_to_filepath):
-  """Ensure regional indicators are only in sequences of one or two, and
-  never mixed."""
-  for seq, fp in sorted_seq_to_filepath.items():
-    have_reg = None
-    for cp in seq:
-      is_reg = unicode_data.is_regional_indicator(cp)
-      if have_reg == None:
-        have_reg = is_reg
-      elif have_reg != is_reg:
-        print(
-            f'check flags: mix of regional and non-regional in {fp}',
-            file=sys.stderr)
-    if have_reg and len(seq) > 2:
-      # We provide dummy glyphs for regional indicators, so there are sequences
-      # with single regional indicator symbols, the len check handles this.
-      print(
-          f'check flags: regional indicator sequence length != 2 in {fp}',
-          file=sys.stderr)
-
-def _check_tags(sorted_seq_to_filepath):
-  """Ensure tag sequences (for subregion flags) conform to the spec.  We don't
-  validate against CLDR, just that there's a sequence of 2 or more tags starting
-  and ending with the appropriate codepoints."""
-
-  BLACK_FLAG = 0x1f3f4
-  BLACK_FLAG_SET = set([BLACK_FLAG])
-  for seq, fp in sorted_seq_to_filepath.items():
-    seq_set = set(cp for cp in seq)
-    overlap_set = seq_set & TAG_SET
-    if not overlap_set:
-      continue
-    if seq[0] != BLACK_FLAG:
-      print(f'check tags: bad start tag in {fp}')
-    elif seq[-1] != END_TAG:
-      print(f'check tags: bad end tag in {fp}')
-    elif len(seq) < 4:
-      print(f'check tags: sequence too short in {fp}')
-    elif seq_set - TAG_SET != BLACK_FLAG_SET:
-      print(f'check tags: non-tag items in {fp}')
-
-
-def _check_skintone(sorted_seq_to_filepath):
-  """Ensure skin tone modifiers are not applied to emoji that are not defined
-  to take them.  May appear standalone, though.  Also check that emoji that take
-  skin tone modifiers have a complete set."""
+  return valid_cps
+
+
+def _cp_props(cps, unicode_version):
+  """Return a mapping from each cp in cps to its property bits."""
+  valid_cps = _valid_emoji_cps(unicode_version)
+  emoji = unicode_data.get_emoji()
+  props = {}
+  for cp in cps:
+    bits = 0
+    if cp in emoji:
+      bits |= _EMOJI
+    if unicode_data.is_emoji_modifier_base(cp):
+      bits |= _MODIFIER_BASE
+    if unicode_data.is_regional_indicator(cp):
+      bits |= _REGIONAL_INDICATOR
+    if unicode_data.is_skintone_modifier(cp):
+      bits |= _SKINTONE
+    if cp in TAG_SET:
+      bits |= _TAG
+    if cp in valid_cps:
+      bits |= _VALID
+    props[cp] = bits
+  return props
+
+
+def _check_sequences(sorted_seq_to_filepath, unicode_version, aliases):
+  """Run every check except coverage over the sequences in one sweep and
+  return a mapping from check name to its list of Diagnostics.
+
+  The checks are:
+  - no_vs: our image data does not use emoji presentation variation
+    selectors.
+  - valid_emoji_cps: all cps are valid emoji cps or specific cps used in
+    forming emoji sequences.
+  - zwj: zwj is only between two appropriate emoji.
+  - flags: regional indicators are only in sequences of one or two, and
+    never mixed.
+  - tags: tag sequences (for subregion flags) are a black flag followed by
+    tags and the end tag.  We don't validate against CLDR.
+  - skintone: skin tone modifiers are only applied to emoji defined to take
+    them, although they may appear standalone, and emoji that take them have
+    a complete set.
+  - zwj_sequences: zwj sequences are valid for the given unicode version.
+  - no_alias_sources: we don't have sequences that we expect to be aliased
+    to some other sequence."""
+
+  cps = set()
+  for seq in sorted_seq_to_filepath:
+    cps.update(seq)
+  props = _cp_props(cps, unicode_version)
+
+  found = {check: [] for check in CHECKS}
+  def report(check, message, fp, to_stderr=True, fatal=False):
+    found[check].append(Diagnostic(check, message, fp, fatal, to_stderr))
+
+  not_emoji = collections.defaultdict(list)
   base_to_modifiers = collections.defaultdict(set)
+  fp = None
   for seq, fp in sorted_seq_to_filepath.items():
-    for i, cp in enumerate(seq):
-      if unicode_data.is_skintone_modifier(cp):
+    bits = [props[cp] for cp in seq]
+    any_bits = 0
+    for b in bits:
+      any_bits |= b
+
+    if EMOJI_VS in seq:
+      report('no_vs', f'check no VS: {EMOJI_VS} in path: {fp}', fp, False)
+
+    if any(not b & _VALID for b in bits):
+      for cp, b in zip(seq, bits):
+        if not b & _VALID:
+          not_emoji[cp].append(fp)
+
+    if ZWJ in seq:
+      if seq[0] == ZWJ:
+        report('zwj', f'check zwj: zwj at head of sequence in {fp}', fp)
+      if len(seq) > 1:
+        if seq[-1] == ZWJ:
+          report('zwj', f'check zwj: zwj at end of sequence in {fp}', fp)
+        for i, cp in enumerate(seq):
+          if cp == ZWJ:
+            if i > 0:
+              pcp = seq[i-1]
+              if pcp != EMOJI_VS and not bits[i-1] & _EMOJI:
+                report(
+                    'zwj', f'check zwj: non-emoji {pcp} precedes ZWJ in {fp}',
+                    fp)
+            if i < len(seq) - 1:
+              fcp = seq[i+1]
+              if not bits[i+1] & _EMOJI:
+                report(
+                    'zwj', f'check zwj: non-emoji {fcp} follows ZWJ in {fp}',
+                    fp)
+
+      age = unicode_data.get_emoji_sequence_age(seq)
+      if age is None or unicode_version is not None and age > unicode_version:
+        report(
+            'zwj_sequences', f'check zwj sequences: undefined sequence {fp}',
+            fp, False)
+
+    if any_bits & _REGIONAL_INDICATOR:
+      have_reg = bool(bits[0] & _REGIONAL_INDICATOR)
+      for b in bits[1:]:
+        if bool(b & _REGIONAL_INDICATOR) != have_reg:
+          report(
+              'flags', f'check flags: mix of regional and non-regional in {fp}',
+              fp)
+      if have_reg and len(seq) > 2:
+        # We provide dummy glyphs for regional indicators, so there are
+        # sequences with single regional indicator symbols, the len check
+        # handles this.
+        report(
+            'flags',
+            f'check flags: regional indicator sequence length != 2 in {fp}', fp)
+
+    if any_bits & _TAG:
+      if seq[0] != BLACK_FLAG:
+        report('tags', f'check tags: bad start tag in {fp}', fp, False)
+      elif seq[-1] != END_TAG:
+        report('tags', f'check tags: bad end tag in {fp}', fp, False)
+      elif len(seq) < 4:
+        report('tags', f'check tags: sequence too short in {fp}', fp, False)
+      elif any(not b & _TAG and cp != BLACK_FLAG
+               for cp, b in zip(seq[1:], bits[1:])):
+        report('tags', f'check tags: non-tag items in {fp}', fp, False)
+
+    if any_bits & _SKINTONE:
+      for i, b in enumerate(bits):
+        if not b & _SKINTONE:
+          continue
         if i == 0:
           if len(seq) > 1:
-            print(
+            report(
+                'skintone',
                 f'check skintone: skin color selector first in sequence {fp}',
-                file=sys.stderr)
+                fp)
           # standalone are ok
           continue
-        pcp = seq[i-1]
-        if not unicode_data.is_emoji_modifier_base(pcp):
-          print(
+        if not bits[i-1] & _MODIFIER_BASE:
+          report(
+              'skintone',
               f'check skintone: emoji skintone modifier applied to non-base at {i}: {fp}',
-              file=sys.stderr)
+              fp)
         else:
-          if pcp not in base_to_modifiers:
-            base_to_modifiers[pcp] = set()
-          base_to_modifiers[pcp].add(cp)
+          base_to_modifiers[seq[i-1]].add(seq[i])
+
+    if seq in aliases:
+      report(
+          'no_alias_sources', f'check no alias sources: aliased sequence {fp}',
+          fp, False)
+
+  if not_emoji:
+    report(
+        'valid_emoji_cps',
+        f'check valid emoji cps: {len(not_emoji)} non-emoji cp found', None,
+        fatal=True)
+    for cp in sorted(not_emoji):
+      fps = not_emoji[cp]
+      report(
+          'valid_emoji_cps',
+          f'check the following cp: {cp} - {fps[0]} (in {len(fps)} sequences)',
+          fps[0], fatal=True)
 
+  # This reports the last path checked, as it always has.
   for cp, modifiers in sorted(base_to_modifiers.items()):
     if len(modifiers) != 5:
-      print(
+      report(
+          'skintone',
           'check skintone: base %04x has %d modifiers defined (%s) in %s' % (
               cp, len(modifiers),
               ', '.join('%04x' % cp for cp in sorted(modifiers)), fp),
-          file=sys.stderr)
+          fp)
 
+  return found
 
-def _check_zwj_sequences(sorted_seq_to_filepath, unicode_version):
-  """Verify that zwj sequences are valid for the given unicode version."""
-  for seq, fp in sorted_seq_to_filepath.items():
-    if ZWJ not in seq:
-      continue
-    age = unicode_data.get_emoji_sequence_age(seq)
-    if age is None or unicode_version is not None and age > unicode_version:
-      print(f'check zwj sequences: undefined sequence {fp}')
 
-
-def _check_no_alias_sources(sorted_seq_to_filepath):
-  """Check that we don't have sequences that we expect to be aliased to
-  some other sequence."""
-  aliases = add_aliases.read_default_emoji_aliases()
-  for seq, fp in sorted_seq_to_filepath.items():
-    if seq in aliases:
-      print(f'check no alias sources: aliased sequence {fp}')
-
-
-def _check_coverage(seq_to_filepath, unicode_version):
+def _check_coverage(seq_to_filepath, unicode_version, aliases):
   """Ensure we have all and only the cps and sequences that we need for the
-  font as of this version."""
+  font as of this version.  Return the list of Diagnostics."""
 
-  coverage_pass = True
-  age = unicode_version
+  diagnostics = []
+  def report(message):
+    diagnostics.append(Diagnostic('coverage', message, None, True, False))
 
   non_vs_to_canonical = {}
   for k in seq_to_filepath:
@@ -262,19 +281,16 @@ def _check_coverage(seq_to_filepath, unicode_version):
       non_vs = unicode_data.strip_emoji_vs(k)
       non_vs_to_canonical[non_vs] = k
 
-  aliases = add_aliases.read_default_emoji_aliases()
   for k, v in sorted(aliases.items()):
     if v not in seq_to_filepath and v not in non_vs_to_canonical:
       alias_str = unicode_data.seq_to_string(k)
       target_str = unicode_data.seq_to_string(v)
-      print(f'coverage: alias {alias_str} missing target {target_str}')
-      coverage_pass = False
+      report(f'coverage: alias {alias_str} missing target {target_str}')
       continue
     if k in seq_to_filepath or k in non_vs_to_canonical:
       alias_str = unicode_data.seq_to_string(k)
       target_str = unicode_data.seq_to_string(v)
-      print(f'coverage: alias {alias_str} already exists as {target_str} ({seq_name(v)})')
-      coverage_pass = False
+      report(f'coverage: alias {alias_str} already exists as {target_str} ({seq_name(v)})')
       continue
     filename = seq_to_filepath.get(v) or seq_to_filepath[non_vs_to_canonical[v]]
     seq_to_filepath[k] = 'alias:' + filename
@@ -283,16 +299,14 @@ def _check_coverage(seq_to_filepath, unicode_version):
   emoji = sorted(unicode_data.get_emoji())
   for cp in emoji:
     if tuple([cp]) not in seq_to_filepath:
-      print(
+      report(
           f'coverage: missing single {cp} ({unicode_data.name(cp)})')
-      coverage_pass = False
 
   # special characters
   # all but combining enclosing keycap are currently marked as emoji
   for cp in [ord('*'), ord('#'), ord(u'\u20e3')] + list(range(0x30, 0x3a)):
     if cp not in emoji and tuple([cp]) not in seq_to_filepath:
-      print(f'coverage: missing special {cp} ({unicode_data.name(cp)})')
-      coverage_pass = False
+      report(f'coverage: missing special {cp} ({unicode_data.name(cp)})')
 
   # combining sequences
   comb_seq_to_name = sorted(
@@ -302,33 +316,51 @@ def _check_coverage(seq_to_filepath, unicode_version):
       # strip vs and try again
       non_vs_seq = unicode_data.strip_emoji_vs(seq)
       if non_vs_seq not in seq_to_filepath:
-        print(f'coverage: missing combining sequence {unicode_data.seq_to_string(seq)} ({name})')
-        coverage_pass = False
-
+        report(f'coverage: missing combining sequence {unicode_data.seq_to_string(seq)} ({name})')
+  
   # check for 'unknown flag'
   # this is either emoji_ufe82b or 'unknown_flag', but we filter out things that
   # don't start with our prefix so 'unknown_flag' would be excluded by default.
   if tuple([0xfe82b]) not in seq_to_filepath:
-    print('coverage: missing unknown flag PUA fe82b')
-    coverage_pass = False
+    report('coverage: missing unknown flag PUA fe82b')
 
-  if not coverage_pass:
-    exit("Please fix the problems mentioned above or run: make BYPASS_SEQUENCE_CHECK='True'")
+  return diagnostics
 
 
-def check_sequence_to_filepath(seq_to_filepath, unicode_version, coverage):
+def check_sequence_to_filepath(
+    seq_to_filepath, unicode_version, coverage, json_output=False):
+  """Run the checks and report their diagnostics, as text or, with
+  json_output, as a JSON document on stdout.  Exits if a check fails."""
   sorted_seq_to_filepath = collections.OrderedDict(
       sorted(seq_to_filepath.items()))
-  _check_no_vs(sorted_seq_to_filepath)
-  _check_valid_emoji_cps(sorted_seq_to_filepath, unicode_version)
-  _check_zwj(sorted_seq_to_filepath)
-  _check_flags(sorted_seq_to_filepath)
-  _check_tags(sorted_seq_to_filepath)
-  _check_skintone(sorted_seq_to_filepath)
-  _check_zwj_sequences(sorted_seq_to_filepath, unicode_version)
-  _check_no_alias_sources(sorted_seq_to_filepath)
+  # add_aliases reports aliases it can't read on stdout
+  with contextlib.redirect_stdout(sys.stderr if json_output else sys.stdout):
+    aliases = add_aliases.read_default_emoji_aliases()
+  found = _check_sequences(sorted_seq_to_filepath, unicode_version, aliases)
   if coverage:
-    _check_coverage(sorted_seq_to_filepath, unicode_version)
+    found['coverage'] = _check_coverage(
+        sorted_seq_to_filepath, unicode_version, aliases)
+
+  diagnostics = [d for check in CHECKS for d in found[check]]
+  failed = any(d.fatal for d in diagnostics)
+  if json_output:
+    json.dump({
+        'sequences': len(seq_to_filepath),
+        'passed': not failed,
+        'diagnostics': [d._asdict() for d in diagnostics],
+    }, sys.stdout, indent=1)
+    print()
+    if failed:
+      sys.exit(1)
+    return
+
+  for d in diagnostics:
+    print(d.message, file=sys.stderr if d.to_stderr else sys.stdout)
+    # a failed cp check stops the other checks from being reported
+    if d.fatal and d.check == 'valid_emoji_cps' and d is found[d.check][-1]:
+      break
+  if failed:
+    exit("Please fix the problems mentioned above or run: make BYPASS_SEQUENCE_CHECK='True'")
 
 
 def create_sequence_to_filepath(name_to_dirpath, prefix, suffix):
@@ -395,26 +427,32 @@ def collect_name_to_dirpath_with_override(dirs, prefix, suffix, exclude=None):
   return result
 
 
-def run_check(dirs, names, prefix, suffix, exclude, unicode_version, coverage):
+def run_check(
+    dirs, names, prefix, suffix, exclude, unicode_version, coverage,
+    json_output=False):
   msg = ''
   if unicode_version:
     msg = ' (%3.1f)' % unicode_version
 
-  if (names and dirs):
-    sys.exit("Please only provide a directory or a list of names")
-  elif names:
-    name_to_dirpath = {}
-    for name in names:
-      name_to_dirpath[name] = ""
-  elif dirs:
-    print(f'Checking files with prefix "{prefix}" and suffix "{suffix}"{msg} in: {dirs}')
-    name_to_dirpath = collect_name_to_dirpath_with_override(dirs, prefix=prefix, suffix=suffix, exclude=exclude)
-
-  print(f'checking {len(name_to_dirpath)} names')
-  seq_to_filepath = create_sequence_to_filepath(name_to_dirpath, prefix, suffix)
-  print(f'checking {len(seq_to_filepath)} sequences')
-  check_sequence_to_filepath(seq_to_filepath, unicode_version, coverage)
-  print('Done running checks')
+  # with json_output, only the JSON document goes to stdout
+  with contextlib.redirect_stdout(sys.stderr if json_output else sys.stdout):
+    if (names and dirs):
+      sys.exit("Please only provide a directory or a list of names")
+    elif names:
+      name_to_dirpath = {}
+      for name in names:
+        name_to_dirpath[name] = ""
+    elif dirs:
+      print(f'Checking files with prefix "{prefix}" and suffix "{suffix}"{msg} in: {dirs}')
+      name_to_dirpath = collect_name_to_dirpath_with_override(dirs, prefix=prefix, suffix=suffix, exclude=exclude)
+
+    print(f'checking {len(name_to_dirpath)} names')
+    seq_to_filepath = create_sequence_to_filepath(name_to_dirpath, prefix, suffix)
+    print(f'checking {len(seq_to_filepath)} sequences')
+  check_sequence_to_filepath(
+      seq_to_filepath, unicode_version, coverage, json_output)
+  if not json_output:
+    print('Done running checks')
 
 
 def main():
@@ -440,10 +478,13 @@ def main():
   parser.add_argument(
       '-u', '--unicode_version', help='limit to this unicode version or before',
       metavar='version', type=float)
+  parser.add_argument(
+      '--json', help='print the diagnostics as JSON on stdout',
+      action='store_true')
   args = parser.parse_args()
   run_check(
       args.dirs, args.names, args.prefix, args.suffix, args.exclude, args.unicode_version,
-      args.coverage)
+      args.coverage, args.json)
 
 
 if __name__ == '__main__':
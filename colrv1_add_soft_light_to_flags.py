@@ -1,13 +1,13 @@
 """Utility to add soft-light effect to NotoColorEmoji-COLRv1 region flags."""
+import functools
 import sys
-import subprocess
 from fontTools import ttLib
 from fontTools.ttLib.tables import otTables as ot
 from fontTools.ttLib.tables.C_P_A_L_ import Color
 from fontTools.colorLib.builder import LayerListBuilder
 from add_aliases import read_default_emoji_aliases
-from flag_glyph_name import flag_code_to_glyph_name
-from map_pua_emoji import get_glyph_name_from_gsub
+from flag_glyph_name import flag_code_to_glyph_name, read_flag_lists
+from ligature_index import LigatureIndex
 
 
 REGIONAL_INDICATOR_RANGE = range(0x1F1E6, 0x1F1FF + 1)
@@ -34,14 +34,6 @@ def is_flag(sequence):
     return False
 
 
-def read_makefile_variable(var_name):
-    # see `print-%` command in Makefile
-    value = subprocess.run(
-        ["make", f"print-{var_name}"], capture_output=True, check=True
-    ).stdout.decode("utf-8")
-    return value[len(var_name) + len(" = ") :].strip()
-
-
 def flag_code_to_sequence(flag_code):
     # I use the existing code to first convert from flag code to glyph name,
     # and then convert names back to integer codepoints since it already
@@ -51,17 +43,18 @@ def flag_code_to_sequence(flag_code):
     return tuple(int(v, 16) for v in name[1:].split("_"))
 
 
+@functools.lru_cache(maxsize=None)
 def all_flag_sequences():
     """Return the set of all noto-emoji's region and subdivision flag sequences.
-    These include those in SELECTED_FLAGS Makefile variable plus those listed
-    in the 'emoji_aliases.txt' file.
+    These include those in the SELECTED_FLAGS list of 'flag_lists.mk' plus those
+    listed in the 'emoji_aliases.txt' file.
     """
     result = {
         flag_code_to_sequence(flag_code)
-        for flag_code in read_makefile_variable("SELECTED_FLAGS").split()
+        for flag_code in read_flag_lists()["SELECTED_FLAGS"]
     }
     result.update(seq for seq in read_default_emoji_aliases() if is_flag(seq))
-    return result
+    return frozenset(result)
 
 
 _builder = LayerListBuilder()
@@ -82,17 +75,23 @@ def _paint_composite(source, mode, backdrop):
     )
 
 
-def _palette_index(cpal, color):
+def _palette_indices(cpal, colors):
+    """Return the palette index of each of colors, adding those the palette
+    does not have yet."""
     assert len(cpal.palettes) == 1
     palette = cpal.palettes[0]
-    try:
-        i = palette.index(color)
-    except ValueError:
-        i = len(palette)
-        palette.append(color)
-        cpal.numPaletteEntries += 1
-        assert len(palette) == cpal.numPaletteEntries
-    return i
+    color_to_index = {}
+    for i, color in enumerate(palette):
+        color_to_index.setdefault(color, i)
+    indices = []
+    for color in colors:
+        if color not in color_to_index:
+            color_to_index[color] = len(palette)
+            palette.append(color)
+            cpal.numPaletteEntries += 1
+            assert len(palette) == cpal.numPaletteEntries
+        indices.append(color_to_index[color])
+    return indices
 
 
 WHITE = Color.fromHex("#FFFFFFFF")
@@ -101,6 +100,7 @@ BLACK = Color.fromHex("#000000FF")
 
 
 def _soft_light_gradient(cpal):
+    white, gray, black = _palette_indices(cpal, (WHITE, GRAY, BLACK))
     return _build_paint(
         {
             "Format": ot.PaintFormat.PaintLinearGradient,
@@ -109,17 +109,17 @@ def _soft_light_gradient(cpal):
                 "ColorStop": [
                     {
                         "StopOffset": 0.0,
-                        "PaletteIndex": _palette_index(cpal, WHITE),
+                        "PaletteIndex": white,
                         "Alpha": 0.5,
                     },
                     {
                         "StopOffset": 0.5,
-                        "PaletteIndex": _palette_index(cpal, GRAY),
+                        "PaletteIndex": gray,
                         "Alpha": 0.5,
                     },
                     {
                         "StopOffset": 1.0,
-                        "PaletteIndex": _palette_index(cpal, BLACK),
+                        "PaletteIndex": black,
                         "Alpha": 0.5,
                     },
                 ],
@@ -136,8 +136,9 @@ def _soft_light_gradient(cpal):
 
 def flag_ligature_glyphs(font):
     """Yield ligature glyph names for all the region/subdivision flags in the font."""
+    ligature_index = LigatureIndex(font)
     for flag_sequence in all_flag_sequences():
-        flag_name = get_glyph_name_from_gsub(flag_sequence, font)
+        flag_name = ligature_index.glyph_for_sequence(flag_sequence)
         if flag_name is not None:
             yield flag_name
 
@@ -146,18 +147,23 @@ def add_soft_light_to_flags(font, flag_glyph_names=None):
     """Add soft-light effect to region and subdivision flags in CORLv1 font."""
     if flag_glyph_names is None:
         flag_glyph_names = flag_ligature_glyphs(font)
+    flag_glyph_names = list(flag_glyph_names)
+    if not flag_glyph_names:
+        return
 
     colr_glyphs = {
         rec.BaseGlyph: rec
         for rec in font["COLR"].table.BaseGlyphList.BaseGlyphPaintRecord
     }
-    cpal = font["CPAL"]
+    # The gradient is the same for every flag, so it is built once and all
+    # of them share it.
+    gradient = _soft_light_gradient(font["CPAL"])
 
     for flag_name in flag_glyph_names:
         flag = colr_glyphs[flag_name]
         flag.Paint = _paint_composite(
             source=_paint_composite(
-                source=_soft_light_gradient(cpal),
+                source=gradient,
                 mode=ot.CompositeMode.SRC_IN,
                 backdrop=flag.Paint,
             ),
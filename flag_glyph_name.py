@@ -19,6 +19,7 @@ from __future__ import print_function
 
 __author__ = 'roozbeh@google.com (Roozbeh Pournader)'
 
+from os import path
 import re
 import sys
 
@@ -52,6 +53,27 @@ def flag_code_to_glyph_name(flag_code):
   return two_letter_code_to_glyph_name(flag_code)
 
 
+# The flag lists, shared with the Makefile, which includes this file.
+FLAG_LISTS_FILE = path.join(path.dirname(path.abspath(__file__)), 'flag_lists.mk')
+
+assignment_re = re.compile(r'(\w+)\s*[:?]?=\s*(.*)$')
+_flag_lists = {}
+
+def read_flag_lists(filename=FLAG_LISTS_FILE):
+  """Return a dict from the flag list names in filename, like SELECTED_FLAGS,
+  to their flag codes.  Each file is only read once."""
+  if filename not in _flag_lists:
+    with open(filename) as f:
+      text = f.read().replace('\\\n', ' ')
+    flag_lists = {}
+    for line in text.splitlines():
+      m = assignment_re.match(line.split('#', 1)[0])
+      if m:
+        flag_lists[m.group(1)] = m.group(2).split()
+    _flag_lists[filename] = flag_lists
+  return _flag_lists[filename]
+
+
 def main():
     print(' '.join([
         flag_code_to_glyph_name(flag_code) for flag_code in sys.argv[1:]]))
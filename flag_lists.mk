@@ -0,0 +1,36 @@
+# The flags built into the fonts, by region or subdivision code.
+#
+# The Makefile includes this file, and flag_glyph_name.read_flag_lists
+# reads it for the python tools, so it only holds `NAME = codes` lines.
+
+# Unknown flag is PUA fe82b
+# Note, we omit some flags below that we support via aliasing instead.
+
+LIMITED_FLAGS = CN DE ES FR GB IT JP KR RU US
+SELECTED_FLAGS = AC AD AE AF AG AI AL AM AO AQ AR AS AT AU AW AX AZ \
+	BA BB BD BE BF BG BH BI BJ BL BM BN BO BQ BR BS BT BW BY BZ \
+	CA CC CD CF CG CH CI CK CL CM CN CO CQ CR CU CV CW CX CY CZ \
+	DE DJ DK DM DO DZ \
+	EC EE EG EH ER ES ET EU \
+	FI FJ FK FM FO FR \
+	GA GB GD GE GF GG GH GI GL GM GN GP GQ GR GS GT GU GW GY \
+	HK HN HR HT HU \
+	IC ID IE IL IM IN IO IQ IR IS IT \
+	JE JM JO JP \
+	KE KG KH KI KM KN KP KR KW KY KZ \
+	LA LB LC LI LK LR LS LT LU LV LY \
+	MA MC MD ME MG MH MK ML MM MN MO MP MQ MR MS MT MU MV MW MX MY MZ \
+	NA NC NE NF NG NI NL NO NP NR NU NZ \
+	OM \
+	PA PE PF PG PH PK PL PM PN PR PS PT PW PY \
+	QA \
+	RE RO RS RU RW \
+	SA SB SC SD SE SG SH SI SK SL SM SN SO SR SS ST SV SX SY SZ \
+	TA TC TD TF TG TH TJ TK TL TM TN TO TR TT TV TW TZ \
+	UA UG UN US UY UZ \
+	VA VC VE VG VI VN VU \
+	WF WS \
+	XK \
+	YE YT \
+	ZA ZM ZW \
+        GB-ENG GB-SCT GB-WLS
@@ -3,62 +3,113 @@
 set -e
 set -v
 
+# With --incremental, only the stages whose inputs changed since the last
+# successful build are run, and build/ is kept so make only redoes the
+# images that changed.  A dirty stage runs in full; see rebuild_plan.py for
+# the stages and their inputs.
+INCREMENTAL=
+if [ "$1" = "--incremental" ]; then
+  INCREMENTAL=1
+fi
+STAGES=$(python3 rebuild_plan.py plan)
+stage() {
+  [ -z "$INCREMENTAL" ] || grep -qx "$1" <<< "$STAGES"
+}
+
 # We have to have hb-subset on PATH
 which hb-subset
 
 # Build the CBDT font
 
-rm -rf venv  # in case you have an old borked venv!
-python3 -m venv venv
+if stage venv; then
+  rm -rf venv  # in case you have an old borked venv!
+  python3 -m venv venv
+fi
 source venv/bin/activate
-pip install -r requirements.txt
-pip install cairosvg
-
-rm -rf emojicompat
-git clone https://github.com/googlefonts/emojicompat.git
-pip install emojicompat/
-
-# Generate PNGs
-python gen_pngs.py
-
-# Validation
-python size_check.py
-rm -rf build/* build/.* && time make -j 48
-# Should take 2-3 minutes to create noto-emoji/NotoColorEmoji.ttf
-
-mv *.ttf fonts/
+if stage venv; then
+  pip install -r requirements.txt
+  pip install cairosvg
+
+  rm -rf emojicompat
+  git clone https://github.com/googlefonts/emojicompat.git
+  pip install emojicompat/
+fi
+
+# Keep the python build tools loaded between the steps, see build_server.py
+BUILD_SERVER_DIR=$(mktemp -d)
+export BUILD_SERVER_SOCKET="$BUILD_SERVER_DIR/build_server.sock"
+python build_server.py serve -t NotoColorEmoji.tmpl.ttx.tmpl -a emoji_aliases.txt &
+BUILD_SERVER_PID=$!
+trap 'kill $BUILD_SERVER_PID; wait $BUILD_SERVER_PID; rm -rf "$BUILD_SERVER_DIR"' EXIT
+
+# Drop the images of removed emoji, they are found by wildcard
+if [ -n "$INCREMENTAL" ]; then
+  for name in $(python rebuild_plan.py removed); do
+    rm -f png/*/"$name.png" build/*/"$name.png"
+  done
+fi
+
+# Generate PNGs, unchanged SVGs are skipped
+if stage pngs; then
+  python gen_pngs.py
+fi
+
+if stage cbdt; then
+  # Validation
+  python size_check.py
+  if [ -z "$INCREMENTAL" ]; then
+    rm -rf build/* build/.*
+  fi
+  time make -j 48
+  # Should take 2-3 minutes to create noto-emoji/NotoColorEmoji.ttf
+
+  mv *.ttf fonts/
+fi
 
 # make noflags CBDT font
-rm -f fonts/NotoColorEmoji-noflags.ttf
-python drop_flags.py fonts/NotoColorEmoji.ttf
+if stage noflags; then
+  rm -f fonts/NotoColorEmoji-noflags.ttf
+  python drop_flags.py fonts/NotoColorEmoji.ttf
+fi
 
 # Build the COLRv1 font (slow)
 
-python colrv1_generate_configs.py
-git diff colrv1/*.toml
+if stage colrv1; then
+  python colrv1_generate_configs.py
+  git diff colrv1/*.toml
 
-# Compile the fonts
-# Should take ~20 minutes
-(cd colrv1 && rm -rf build/ && time nanoemoji *.toml)
-cp colrv1/build/NotoColorEmoji.ttf fonts/Noto-COLRv1.ttf
-cp colrv1/build/NotoColorEmoji-noflags.ttf fonts/Noto-COLRv1-noflags.ttf
+  # Compile the fonts
+  # Should take ~20 minutes
+  if [ -z "$INCREMENTAL" ]; then
+    rm -rf colrv1/build/
+  fi
+  (cd colrv1 && time nanoemoji *.toml)
+  cp colrv1/build/NotoColorEmoji.ttf fonts/Noto-COLRv1.ttf
+  cp colrv1/build/NotoColorEmoji-noflags.ttf fonts/Noto-COLRv1-noflags.ttf
 
-# Post-process them
-python colrv1_postproc.py
+  # Post-process them
+  python build_server.py run -- colrv1_postproc.py
+fi
 
 # Produce emojicompat variants
 # Add support for new sequences per https://github.com/googlefonts/emojicompat#support-new-unicode-sequences
 
-pushd fonts
-cp NotoColorEmoji.ttf NotoColorEmoji-emojicompat.ttf
-cp Noto-COLRv1.ttf Noto-COLRv1-emojicompat.ttf
-emojicompat --op setup --font NotoColorEmoji-emojicompat.ttf
-emojicompat --op setup --font Noto-COLRv1-emojicompat.ttf
-emojicompat --op check --font NotoColorEmoji-emojicompat.ttf
-emojicompat --op check --font Noto-COLRv1-emojicompat.ttf
-popd
-
-hb-subset --unicodes-file=flags-only-unicodes.txt \
-   --output-file=fonts/NotoColorEmoji-flagsonly.ttf \
-   fonts/NotoColorEmoji.ttf
-python update_flag_name.py
+if stage emojicompat; then
+  pushd fonts
+  cp NotoColorEmoji.ttf NotoColorEmoji-emojicompat.ttf
+  cp Noto-COLRv1.ttf Noto-COLRv1-emojicompat.ttf
+  emojicompat --op setup --font NotoColorEmoji-emojicompat.ttf
+  emojicompat --op setup --font Noto-COLRv1-emojicompat.ttf
+  emojicompat --op check --font NotoColorEmoji-emojicompat.ttf
+  emojicompat --op check --font Noto-COLRv1-emojicompat.ttf
+  popd
+fi
+
+if stage flagsonly; then
+  hb-subset --unicodes-file=flags-only-unicodes.txt \
+     --output-file=fonts/NotoColorEmoji-flagsonly.ttf \
+     fonts/NotoColorEmoji.ttf
+  python build_server.py run -- update_flag_name.py
+fi
+
+python rebuild_plan.py commit
@@ -1,41 +1,162 @@
 #!/usr/bin/env python3
+import argparse
+import hashlib
+import json
+import multiprocessing
 import os
-import cairosvg
+import time
+
+from cairosvg.parser import Tree
+from cairosvg.surface import PNGSurface
 
 # Input and output configuration
 svg_dir = "svg"
 output_base_dir = "png"
 dimensions = [32, 72, 128, 512]
 
-# Create the input folder if it doesn't exist
-if not os.path.exists(svg_dir):
-    os.makedirs(svg_dir)
-    print(f"Created '{svg_dir}' folder. Please add SVG files to convert.")
-    exit(0)
-
-# Create output directories
-for dim in dimensions:
-    os.makedirs(os.path.join(output_base_dir, str(dim)), exist_ok=True)
-
-# Process each SVG file
-for filename in os.listdir(svg_dir):
-    if filename.lower().endswith(".svg"):
-        svg_path = os.path.join(svg_dir, filename)
-        name_without_ext = os.path.splitext(filename)[0]
-
-        for dim in dimensions:
-            output_dir = os.path.join(output_base_dir, str(dim))
-            output_path = os.path.join(output_dir, f"{name_without_ext}.png")
-
-            try:
-                cairosvg.svg2png(
-                    url=svg_path,
-                    write_to=output_path,
-                    output_width=dim,
-                    output_height=dim
-                )
-                print(f"✓ Converted {filename} to {dim}x{dim} PNG.")
-            except Exception as e:
-                print(f"✗ Failed to convert {filename} at {dim}x{dim}: {e}")
-
-print("✅ All done!")
+# Source hash of every SVG whose PNGs are up to date, kept in the output dir
+manifest_name = ".gen_pngs_manifest.json"
+
+
+def file_hash(path):
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def output_path(filename, dim):
+    name_without_ext = os.path.splitext(filename)[0]
+    return os.path.join(output_base_dir, str(dim), f"{name_without_ext}.png")
+
+
+def render_svg(filename):
+    """Render one SVG at every size.  Runs in a worker process, so it returns
+    the messages instead of printing them.
+
+    Only the file read is shared between the sizes: the SVG is still parsed
+    once per size.  cairosvg changes the tree while it draws it (use, mask
+    and pattern nodes are rewritten in place), so a tree cannot be reused,
+    and a copy.deepcopy of it takes longer than parsing the bytes again."""
+    svg_path = os.path.join(svg_dir, filename)
+    start = time.time()
+    messages = []
+    ok = True
+    try:
+        with open(svg_path, "rb") as f:
+            svg_data = f.read()
+    except OSError as e:
+        return filename, False, time.time() - start, [f"✗ Failed to read {filename}: {e}"]
+
+    for dim in dimensions:
+        try:
+            tree = Tree(bytestring=svg_data, url=svg_path)
+            PNGSurface(
+                tree,
+                output_path(filename, dim),
+                96,
+                output_width=dim,
+                output_height=dim,
+            ).finish()
+            messages.append(f"✓ Converted {filename} to {dim}x{dim} PNG.")
+        except Exception as e:
+            ok = False
+            messages.append(f"✗ Failed to convert {filename} at {dim}x{dim}: {e}")
+    return filename, ok, time.time() - start, messages
+
+
+def load_manifest(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def is_up_to_date(entry, source_hash, filename):
+    return (
+        entry is not None
+        and entry["sha256"] == source_hash
+        and entry["dimensions"] == dimensions
+        and all(os.path.exists(output_path(filename, dim)) for dim in dimensions)
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=f"Render the SVGs in '{svg_dir}' to PNGs in "
+        f"'{output_base_dir}/<size>' at sizes {dimensions}."
+    )
+    parser.add_argument(
+        "-j", "--jobs", type=int, help="number of worker processes (default: cpu count)"
+    )
+    parser.add_argument(
+        "-f", "--force", action="store_true", help="render SVGs that have not changed"
+    )
+    parser.add_argument(
+        "-r", "--report", metavar="file", help="write the render time of each SVG to this JSON file"
+    )
+    args = parser.parse_args()
+
+    # Create the input folder if it doesn't exist
+    if not os.path.exists(svg_dir):
+        os.makedirs(svg_dir)
+        print(f"Created '{svg_dir}' folder. Please add SVG files to convert.")
+        exit(0)
+
+    # Create output directories
+    for dim in dimensions:
+        os.makedirs(os.path.join(output_base_dir, str(dim)), exist_ok=True)
+
+    manifest_path = os.path.join(output_base_dir, manifest_name)
+    manifest = {} if args.force else load_manifest(manifest_path)
+
+    # Hash every SVG and only render the ones that changed
+    source_hashes = {}
+    todo = []
+    for filename in sorted(os.listdir(svg_dir)):
+        if filename.lower().endswith(".svg"):
+            source_hash = file_hash(os.path.join(svg_dir, filename))
+            source_hashes[filename] = source_hash
+            if not is_up_to_date(manifest.get(filename), source_hash, filename):
+                todo.append(filename)
+    skipped = len(source_hashes) - len(todo)
+    if skipped:
+        print(f"Skipping {skipped} unchanged SVG files.")
+
+    # Process each SVG file
+    times = {}
+    failed = 0
+    with multiprocessing.Pool(args.jobs) as pool:
+        for filename, ok, seconds, messages in pool.imap_unordered(render_svg, todo):
+            for message in messages:
+                print(message)
+            times[filename] = seconds
+            if ok:
+                manifest[filename] = {
+                    "sha256": source_hashes[filename],
+                    "dimensions": dimensions,
+                }
+            else:
+                failed += 1
+                manifest.pop(filename, None)
+
+    # Forget SVGs that were removed
+    manifest = {k: v for k, v in manifest.items() if k in source_hashes}
+    with open(manifest_path, "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+
+    if args.report:
+        report = {
+            "rendered": len(todo),
+            "skipped": skipped,
+            "failed": failed,
+            "total_seconds": sum(times.values()),
+            "files": dict(sorted(times.items(), key=lambda item: -item[1])),
+        }
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=1)
+
+    print("✅ All done!")
+
+
+if __name__ == "__main__":
+    main()
@@ -34,9 +34,9 @@ import string
 import sys
 
 from nototools import tool_utils
-from nototools import unicode_data
 
 import add_aliases
+import unicode_snapshot as unicode_data
 
 _default_dir = 'png/128'
 _default_ext = 'png'
@@ -28,9 +28,9 @@ import re
 import sys
 
 import generate_emoji_html
+import unicode_snapshot as unicode_data
 
 from nototools import tool_utils
-from nototools import unicode_data
 
 def _create_custom_gendered_seq_names():
   """The names have detail that is adequately represented by the image."""
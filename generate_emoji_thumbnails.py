@@ -30,9 +30,9 @@ import shutil
 import subprocess
 
 import add_aliases
+import unicode_snapshot as unicode_data
 
 from nototools import tool_utils
-from nototools import unicode_data
 
 logger = logging.getLogger('emoji_thumbnails')
 
@@ -0,0 +1,408 @@
+#!/usr/bin/env python3
+
+"""Pad, quantize and compress emoji images in a pool of worker processes.
+
+This does the same work as the convert, pngquant and zopflipng steps in the
+Makefile, without starting three processes per image.  Each image is padded
+to the body size with Pillow, quantized with libimagequant, and recompressed
+with zopflipng.  The imagequant and zopfli Python modules are optional; if
+either is missing, that step runs the pngquant or zopflipng command instead,
+still from inside the worker.
+
+The quantize step takes the pngquant flags of the Makefile (PNGQUANTFLAGS).
+The pngquant command gets them as they are.  For libimagequant, --speed,
+--quality, --skip-if-larger, --nofs and --floyd are applied as pngquant
+applies them; other flags are an error, since libimagequant would ignore
+them.  As with pngquant, the padded image is kept when quantizing cannot
+reach the minimum quality, or, with --skip-if-larger, when the quantized
+image is larger.  The padded, quantized and compressed images are written
+to the same directories the Makefile uses.  A manifest in the compressed
+directory records the size, pngquant flags and tool versions each output
+was made with, and
+outputs that are newer than their source and were made with the current
+settings are left alone.  With a cache directory, every step goes through
+artifact_cache."""
+
+import argparse
+import collections
+import functools
+import glob
+import io
+import json
+import multiprocessing
+import os
+from os import path
+import shlex
+import shutil
+import subprocess
+import time
+
+from PIL import Image
+
+from artifact_cache import ArtifactCache, tool_key
+
+try:
+    import imagequant
+except ImportError:
+    imagequant = None
+
+try:
+    import zopfli.png
+except ImportError:
+    zopfli = None
+
+
+PNGQUANT = "pngquant"
+ZOPFLIPNG = "zopflipng"
+
+# As in the Makefile.
+DEFAULT_PNGQUANT_FLAGS = "--speed 1 --skip-if-larger --quality 85-95 --force"
+
+# In the compressed directory, maps each output to the settings it was made
+# with.
+MANIFEST = ".image_pipeline.json"
+
+# tool identifies the code behind the steps, and is filled in by
+# process_images.
+Options = collections.namedtuple(
+    "Options",
+    "padded_dir quantized_dir compressed_dir size pngquant_flags cache_dir tool",
+    defaults=(None,),
+)
+
+
+def pad_image(in_file, out_file, size):
+    """Center the image on a transparent canvas of the given size."""
+    image = Image.open(in_file).convert("RGBA")
+    canvas = Image.new("RGBA", size, (0, 0, 0, 0))
+    canvas.paste(
+        image, ((size[0] - image.width) // 2, (size[1] - image.height) // 2)
+    )
+    canvas.save(out_file, "PNG")
+    return "padded"
+
+
+# The pngquant flags that libimagequant can apply.
+QuantizeFlags = collections.namedtuple(
+    "QuantizeFlags", "speed quality dithering skip_if_larger"
+)
+
+
+def parse_pngquant_flags(flags):
+    """Return the QuantizeFlags for a pngquant command line, given as a
+    string.  Raise ValueError for flags libimagequant cannot apply."""
+    # pngquant's defaults
+    speed, quality, dithering, skip_if_larger = 4, (0, 100), 1.0, False
+    args = shlex.split(flags)
+    while args:
+        arg = args.pop(0)
+        name, _, value = arg.partition("=")
+        if name in ("--speed", "-s", "--quality", "-Q") and not value:
+            if not args:
+                raise ValueError("pngquant flag %s needs a value" % name)
+            value = args.pop(0)
+        if name in ("--speed", "-s"):
+            speed = int(value)
+        elif name in ("--quality", "-Q"):
+            low, _, high = value.rpartition("-")
+            quality = (int(low) if low else 0, int(high))
+        elif name == "--skip-if-larger":
+            skip_if_larger = True
+        elif name == "--nofs":
+            dithering = 0.0
+        elif name == "--floyd":
+            dithering = float(value) if value else 1.0
+        elif name in ("--force", "-f"):
+            pass # the output is always overwritten
+        else:
+            raise ValueError("libimagequant cannot apply pngquant flag %s" % arg)
+    return QuantizeFlags(speed, quality, dithering, skip_if_larger)
+
+
+def _quantize_with_imagequant(image, flags):
+    """Like imagequant.quantize_pil_image, which cannot set the speed.
+    Return None if the minimum quality cannot be reached."""
+    lib, ffi = imagequant.lib, imagequant.ffi
+    width, height = image.size
+    data = image.tobytes()
+    attr = lib.liq_attr_create()
+    liq_image = result_p = None
+    try:
+        lib.liq_set_speed(attr, flags.speed)
+        lib.liq_set_quality(attr, *flags.quality)
+        liq_image = lib.liq_image_create_rgba(attr, data, width, height, 0)
+        result_p = ffi.new("liq_result**")
+        if lib.liq_image_quantize(liq_image, attr, result_p) != lib.LIQ_OK:
+            return None
+        lib.liq_set_dithering_level(result_p[0], flags.dithering)
+        pixels = ffi.new("char[]", width * height)
+        lib.liq_write_remapped_image(result_p[0], liq_image, pixels, width * height)
+        palette = [
+            component
+            for color in lib.liq_get_palette(result_p[0]).entries
+            for component in (color.r, color.g, color.b, color.a)
+        ]
+        quantized = Image.frombytes("P", (width, height), ffi.unpack(pixels, width * height))
+    finally:
+        if result_p is not None:
+            lib.liq_result_destroy(result_p[0])
+        if liq_image is not None:
+            lib.liq_image_destroy(liq_image)
+        lib.liq_attr_destroy(attr)
+    quantized.putpalette(palette, rawmode="RGBA")
+    return quantized
+
+
+def quantize_image(in_file, out_file, pngquant_flags):
+    """Quantize the image to a palette as pngquant would with
+    pngquant_flags, or copy it if that fails to reach the minimum quality,
+    or, with --skip-if-larger, makes the file larger."""
+    if imagequant is None:
+        status = subprocess.call(
+            [PNGQUANT] + shlex.split(pngquant_flags) + ["-o", out_file, in_file]
+        )
+        if status in (98, 99):
+            shutil.copyfile(in_file, out_file)
+            return "kept"
+        if status:
+            raise ValueError("%s failed on %s" % (PNGQUANT, in_file))
+        return "quantized"
+
+    flags = parse_pngquant_flags(pngquant_flags)
+    quantized = _quantize_with_imagequant(Image.open(in_file).convert("RGBA"), flags)
+    if quantized is None:
+        shutil.copyfile(in_file, out_file)
+        return "kept"
+    data = io.BytesIO()
+    quantized.save(data, "PNG")
+    if flags.skip_if_larger and data.tell() > path.getsize(in_file):
+        shutil.copyfile(in_file, out_file)
+        return "kept"
+    with open(out_file, "wb") as f:
+        f.write(data.getvalue())
+    return "quantized"
+
+
+def compress_image(in_file, out_file):
+    if zopfli is None:
+        subprocess.check_call(
+            [ZOPFLIPNG, "-y", in_file, out_file],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        return "compressed"
+    with open(in_file, "rb") as f:
+        data = zopfli.png.optimize(f.read())
+    with open(out_file, "wb") as f:
+        f.write(data)
+    return "compressed"
+
+
+def pipeline_tool_key():
+    """Identify the code behind the steps: this script, Pillow, and the
+    imagequant and zopfli modules or the commands run in their place."""
+    files = [path.abspath(__file__)]
+    packages = ["Pillow"]
+    if imagequant is None:
+        files.append(PNGQUANT)
+    else:
+        packages.append("imagequant")
+    if zopfli is None:
+        files.append(ZOPFLIPNG)
+    else:
+        packages.append("zopfli")
+    return tool_key(files, packages)
+
+
+def _step(cache, stage, flags, tool, in_file, out_file, fn):
+    if cache is not None:
+        key = cache.key(stage, flags, in_file, tool)
+        if cache.get(key, out_file):
+            return "cached"
+    result = fn(in_file, out_file)
+    if cache is not None:
+        cache.put(key, out_file)
+    return result
+
+
+def _settings(options):
+    """Return a string for everything besides the source that the outputs
+    depend on."""
+    return "%dx%d %s %s" % (*options.size, options.pngquant_flags, options.tool)
+
+
+def _read_manifest(compressed_dir):
+    try:
+        with open(path.join(compressed_dir, MANIFEST)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_manifest(compressed_dir, manifest):
+    manifest_file = path.join(compressed_dir, MANIFEST)
+    tmp_file = manifest_file + ".tmp"
+    with open(tmp_file, "w") as f:
+        json.dump(manifest, f, indent=0, sort_keys=True)
+    os.replace(tmp_file, manifest_file)
+
+
+def _is_up_to_date(out_file, in_file, made_with, settings):
+    return (
+        made_with == settings
+        and path.exists(out_file)
+        and path.getmtime(out_file) >= path.getmtime(in_file)
+    )
+
+
+def process_image(src_file, options):
+    """Run one image through all steps.  Return the outcome of the quantize
+    step, which is the one that decides what ends up in the font."""
+    name = path.basename(src_file)
+    padded = path.join(options.padded_dir, name)
+    quantized = path.join(options.quantized_dir, name)
+    compressed = path.join(options.compressed_dir, name)
+    if options.tool is None:
+        options = options._replace(tool=pipeline_tool_key())
+
+    cache = ArtifactCache(options.cache_dir) if options.cache_dir else None
+    # The steps produce different bytes than the command line tools, so the
+    # stage names keep their cache entries apart.
+    _step(
+        cache, "py-pad", "%dx%d" % options.size, options.tool, src_file, padded,
+        functools.partial(pad_image, size=options.size),
+    )
+    result = _step(
+        cache,
+        "py-quantize",
+        "%s %s" % ("imagequant" if imagequant else PNGQUANT, options.pngquant_flags),
+        options.tool,
+        padded,
+        quantized,
+        functools.partial(quantize_image, pngquant_flags=options.pngquant_flags),
+    )
+    _step(
+        cache, "py-compress", "zopfli" if zopfli else ZOPFLIPNG, options.tool,
+        quantized, compressed, compress_image,
+    )
+    return result
+
+
+def collect_images(src_dirs, prefix="emoji_u"):
+    src_files = []
+    for src_dir in src_dirs:
+        src_files.extend(sorted(glob.glob(path.join(src_dir, "%s*.png" % prefix))))
+    return src_files
+
+
+def _process_named_image(src_file, options):
+    return path.basename(src_file), process_image(src_file, options)
+
+
+def process_images(src_files, options, jobs=None):
+    """Process src_files in a pool of jobs workers and return a Counter of the
+    outcomes, which include 'up to date' for the images that were left
+    alone."""
+    for d in (options.padded_dir, options.quantized_dir, options.compressed_dir):
+        os.makedirs(d, exist_ok=True)
+    if options.tool is None:
+        options = options._replace(tool=pipeline_tool_key())
+    settings = _settings(options)
+    manifest = _read_manifest(options.compressed_dir)
+
+    counts = collections.Counter()
+    stale_files = []
+    for src_file in src_files:
+        name = path.basename(src_file)
+        compressed = path.join(options.compressed_dir, name)
+        if _is_up_to_date(compressed, src_file, manifest.get(name), settings):
+            counts["up to date"] += 1
+        else:
+            stale_files.append(src_file)
+    if not stale_files:
+        return counts
+
+    process = functools.partial(_process_named_image, options=options)
+    try:
+        with multiprocessing.Pool(jobs) as pool:
+            for name, outcome in pool.imap_unordered(
+                process, stale_files, chunksize=8
+            ):
+                manifest[name] = settings
+                counts[outcome] += 1
+    finally:
+        # keep the images that were done if another one failed
+        _write_manifest(options.compressed_dir, manifest)
+    return counts
+
+
+def _parse_pair(text, sep):
+    first, second = text.split(sep)
+    return int(first), int(second)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "src_dirs", help="directories of images to process", metavar="dir",
+        nargs="+",
+    )
+    parser.add_argument(
+        "--padded_dir", help="output directory for padded images",
+        metavar="dir", default="build/emoji",
+    )
+    parser.add_argument(
+        "--quantized_dir", help="output directory for quantized images",
+        metavar="dir", default="build/quantized_pngs",
+    )
+    parser.add_argument(
+        "--compressed_dir", help="output directory for compressed images",
+        metavar="dir", default="build/compressed_pngs",
+    )
+    parser.add_argument(
+        "-s", "--size", help="size to pad images to (default 136x128)",
+        metavar="WxH", default="136x128",
+    )
+    parser.add_argument(
+        "-p", "--pngquant_flags",
+        help="pngquant flags, as PNGQUANTFLAGS in the Makefile (default %r)"
+        % DEFAULT_PNGQUANT_FLAGS,
+        metavar="flags", default=DEFAULT_PNGQUANT_FLAGS,
+    )
+    parser.add_argument(
+        "-c", "--cache_dir", help="artifact cache directory", metavar="dir"
+    )
+    parser.add_argument(
+        "-j", "--jobs", help="number of worker processes (default: cpu count)",
+        metavar="n", type=int,
+    )
+    args = parser.parse_args()
+    if imagequant is not None:
+        try:
+            parse_pngquant_flags(args.pngquant_flags)
+        except ValueError as e:
+            parser.error(str(e))
+
+    options = Options(
+        args.padded_dir,
+        args.quantized_dir,
+        args.compressed_dir,
+        _parse_pair(args.size, "x"),
+        args.pngquant_flags,
+        args.cache_dir,
+    )
+    start = time.time()
+    src_files = collect_images(args.src_dirs)
+    counts = process_images(src_files, options, args.jobs)
+    print(
+        "Processed %d images in %.1fs: %s."
+        % (
+            len(src_files),
+            time.time() - start,
+            ", ".join("%d %s" % (n, outcome) for outcome, n in sorted(counts.items())),
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
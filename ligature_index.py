@@ -0,0 +1,49 @@
+"""Constant-time lookup of ligature glyphs in a font's GSUB table."""
+
+from nototools import font_data
+
+
+def _ligature_subtables(font):
+    if "GSUB" not in font:
+        return
+    for lookup in font["GSUB"].table.LookupList.Lookup:
+        for subtable in lookup.SubTable:
+            # extension lookups wrap the real subtable
+            subtable = getattr(subtable, "ExtSubTable", subtable)
+            if hasattr(subtable, "ligatures"):
+                yield subtable
+
+
+class LigatureIndex:
+    """Maps sequences of glyph names, or of characters via the cmap, to the
+    name of the ligature glyph that GSUB substitutes for them.
+
+    The index is built once from every ligature subtable in the font.  If the
+    same sequence occurs more than once, the one in the earliest lookup wins,
+    since that is the one that gets applied.  Ligatures added to the font
+    afterwards are not seen; build a new index instead."""
+
+    def __init__(self, font, cmap=None):
+        self.cmap = font_data.get_cmap(font) if cmap is None else cmap
+        self.ligatures = {}
+        for subtable in _ligature_subtables(font):
+            for first_glyph, ligatures in subtable.ligatures.items():
+                for ligature in ligatures:
+                    key = (first_glyph,) + tuple(ligature.Component)
+                    self.ligatures.setdefault(key, ligature.LigGlyph)
+
+    def glyph_for_glyphs(self, glyph_names):
+        """Return the ligature glyph name for a sequence of glyph names, or None."""
+        return self.ligatures.get(tuple(glyph_names))
+
+    def glyph_for_sequence(self, char_seq):
+        """Return the ligature glyph name for a sequence of codepoints (or a
+        string), or None if the font has no such ligature or does not map all
+        of the characters."""
+        try:
+            glyph_names = tuple(
+                self.cmap[ch if isinstance(ch, int) else ord(ch)] for ch in char_seq
+            )
+        except KeyError:
+            return None
+        return self.ligatures.get(glyph_names)
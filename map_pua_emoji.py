@@ -26,37 +26,17 @@ from fontTools import ttLib
 from nototools import font_data
 
 import add_emoji_gsub
-
-
-def get_glyph_name_from_gsub(char_seq, font):
-    """Find the glyph name for ligature of a given character sequence from GSUB.
-    """
-    cmap = font_data.get_cmap(font)
-    # FIXME: So many assumptions are made here.
-    try:
-        first_glyph = cmap[char_seq[0]]
-        rest_of_glyphs = [cmap[ch] for ch in char_seq[1:]]
-    except KeyError:
-        return None
-
-    for lookup in font['GSUB'].table.LookupList.Lookup:
-        ligatures = lookup.SubTable[0].ligatures
-        try:
-            for ligature in ligatures[first_glyph]:
-                if ligature.Component == rest_of_glyphs:
-                    return ligature.LigGlyph
-        except KeyError:
-            continue
-    return None
+from ligature_index import LigatureIndex
 
 
 def add_pua_cmap_to_font(font):
     cmap = font_data.get_cmap(font)
+    ligature_index = LigatureIndex(font, cmap)
     for pua, (ch1, ch2) in itertools.chain(
         add_emoji_gsub.EMOJI_KEYCAPS.items(), add_emoji_gsub.EMOJI_FLAGS.items()
     ):
         if pua not in cmap:
-            glyph_name = get_glyph_name_from_gsub([ch1, ch2], font)
+            glyph_name = ligature_index.glyph_for_sequence([ch1, ch2])
             if glyph_name is not None:
                 cmap[pua] = glyph_name
 
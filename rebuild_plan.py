@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+
+"""Work out which stages of full_rebuild.sh need to run again.
+
+The inputs of the build are hashed and compared with the hashes recorded
+after the last successful build.  A stage is dirty if one of its inputs
+changed, one of its outputs is missing, or a stage it depends on is dirty.
+
+  rebuild_plan.py plan      print the dirty stages, one per line, and
+                            remember the current input hashes
+  rebuild_plan.py glyphs    print the changed, added and removed glyphs
+  rebuild_plan.py removed   print the names of the removed glyphs
+  rebuild_plan.py commit    record the hashes remembered by the last plan as
+                            built, once the build has succeeded
+
+Skipping is per stage only: a dirty stage runs in full.  The dirty glyphs
+are reported, and removed glyphs have their images deleted, but a changed
+SVG still reruns the whole CBDT make (which only redoes the images that
+changed) and nanoemoji.
+
+Only the standard library is used, since this runs before the venv exists."""
+
+import argparse
+import collections
+import glob
+import hashlib
+import json
+import os
+from os import path
+import re
+import sys
+
+
+STATE_FILE = ".rebuild_state.json"
+PENDING_FILE = ".rebuild_state.pending.json"
+
+_VERSION = 1
+
+# The Makefile variables that select which flags are built, and the files
+# they are set in.
+_FLAG_LIST_VARS = ("LIMITED_FLAGS", "SELECTED_FLAGS", "FLAGS")
+_FLAG_LIST_FILES = ("Makefile", "flag_lists.mk")
+
+# Input groups, each a list of glob patterns.  The svg group is also
+# compared file by file to find the dirty glyphs.
+INPUTS = {
+    "requirements": ["requirements.txt"],
+    "svg": ["svg/*.svg"],
+    "waved_flags": ["third_party/region-flags/waved-svg/*.svg"],
+    "flag_pngs": ["third_party/region-flags/png/*.png"],
+    "aliases": ["emoji_aliases.txt"],
+    "template": ["NotoColorEmoji.tmpl.ttx.tmpl"],
+    # Flags, tool options and recipes of the CBDT build all live here.
+    "makefile": list(_FLAG_LIST_FILES),
+    "gen_pngs": ["gen_pngs.py", "size_check.py"],
+    "cbdt_tools": [
+        "add_aliases.py",
+        "add_emoji_gsub.py",
+        "add_glyphs.py",
+        "artifact_cache.py",
+        "build_cbdt.py",
+        "check_emoji_sequences.py",
+        "flag_glyph_name.py",
+        "image_pipeline.py",
+        "ligature_index.py",
+        "map_pua_emoji.py",
+        "waveflag.c",
+        "third_party/color_emoji/*.py",
+    ],
+    "drop_flags": ["drop_flags.py"],
+    "colrv1_tools": [
+        "colrv1_generate_configs.py",
+        "colrv1_postproc.py",
+        "colrv1_add_soft_light_to_flags.py",
+        "map_pua_emoji.py",
+    ],
+    "flags_only": ["flags-only-unicodes.txt", "update_flag_name.py"],
+}
+
+Stage = collections.namedtuple("Stage", "name inputs deps outputs")
+
+# In the order full_rebuild.sh runs them.
+STAGES = (
+    Stage("venv", ("requirements",), (), ("venv", "emojicompat")),
+    Stage("pngs", ("svg", "gen_pngs"), ("venv",), ("png/128",)),
+    Stage(
+        "cbdt",
+        ("makefile", "flag_pngs", "aliases", "template", "cbdt_tools"),
+        ("pngs",),
+        ("fonts/NotoColorEmoji.ttf",),
+    ),
+    Stage("noflags", ("drop_flags",), ("cbdt",), ("fonts/NotoColorEmoji-noflags.ttf",)),
+    # colrv1_postproc rewrites the nanoemoji output in place and copies data
+    # from the CBDT font, so it always runs together with nanoemoji.
+    Stage(
+        "colrv1",
+        ("svg", "waved_flags", "flag_lists", "colrv1_tools"),
+        ("venv", "cbdt"),
+        ("fonts/Noto-COLRv1.ttf", "fonts/Noto-COLRv1-noflags.ttf"),
+    ),
+    Stage(
+        "emojicompat",
+        (),
+        ("cbdt", "colrv1"),
+        (
+            "fonts/NotoColorEmoji-emojicompat.ttf",
+            "fonts/Noto-COLRv1-emojicompat.ttf",
+        ),
+    ),
+    Stage(
+        "flagsonly",
+        ("flags_only",),
+        ("cbdt",),
+        ("fonts/NotoColorEmoji-flagsonly.ttf",),
+    ),
+)
+
+
+def _sha256(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+class FileHasher:
+    """Hashes files, reusing the previous hash of files whose mtime and size
+    have not changed."""
+
+    def __init__(self, previous):
+        self.previous = previous
+        self.stats = {}
+
+    def hash(self, filename):
+        st = os.stat(filename)
+        entry = self.previous.get(filename)
+        if entry and entry["mtime"] == st.st_mtime_ns and entry["size"] == st.st_size:
+            digest = entry["sha256"]
+        else:
+            with open(filename, "rb") as f:
+                digest = _sha256(f.read())
+        self.stats[filename] = {
+            "mtime": st.st_mtime_ns,
+            "size": st.st_size,
+            "sha256": digest,
+        }
+        return digest
+
+
+def flag_lists(makefiles=_FLAG_LIST_FILES):
+    """Return the flag list variables of the Makefile and flag_lists.mk,
+    with continuation lines joined, so edits elsewhere in the Makefile do
+    not count for the stages that only use the flag lists."""
+    values = {}
+    for makefile in makefiles:
+        with open(makefile) as f:
+            text = f.read().replace("\\\n", " ")
+        for line in text.splitlines():
+            m = re.match(r"(\w+)\s*[:?]?=\s*(.*)$", line)
+            if m and m.group(1) in _FLAG_LIST_VARS:
+                values[m.group(1)] = " ".join(m.group(2).split())
+    return values
+
+
+def hash_inputs(hasher):
+    """Return a mapping from input group to a mapping from file to hash."""
+    groups = {}
+    for group, patterns in INPUTS.items():
+        files = {}
+        for pattern in patterns:
+            for filename in sorted(glob.glob(pattern)):
+                files[filename] = hasher.hash(filename)
+        groups[group] = files
+    groups["flag_lists"] = {
+        var: _sha256(value.encode("utf-8")) for var, value in flag_lists().items()
+    }
+    return groups
+
+
+def _load(filename):
+    try:
+        with open(filename) as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if state.get("version") != _VERSION:
+        return None
+    return state
+
+
+def _save(filename, state):
+    tmp_file = "%s.%d.tmp" % (filename, os.getpid())
+    with open(tmp_file, "w") as f:
+        json.dump(state, f, indent=1, sort_keys=True)
+    os.replace(tmp_file, filename)
+
+
+def dirty_stages(groups, built_groups):
+    dirty = []
+    for stage in STAGES:
+        if (
+            any(groups[g] != built_groups.get(g) for g in stage.inputs)
+            or any(not path.exists(output) for output in stage.outputs)
+            or any(dep in dirty for dep in stage.deps)
+        ):
+            dirty.append(stage.name)
+    return dirty
+
+
+def dirty_glyphs(svg_files, built_svg_files):
+    """Return a dict with the sorted names of the changed, added and
+    removed glyphs."""
+
+    def glyph(filename):
+        return path.splitext(path.basename(filename))[0]
+
+    return {
+        "changed": sorted(
+            glyph(f)
+            for f, digest in svg_files.items()
+            if f in built_svg_files and built_svg_files[f] != digest
+        ),
+        "added": sorted(glyph(f) for f in svg_files if f not in built_svg_files),
+        "removed": sorted(glyph(f) for f in built_svg_files if f not in svg_files),
+    }
+
+
+def plan():
+    """Compare the inputs with the last successful build, print the dirty
+    stages and remember the current hashes for commit."""
+    built = _load(STATE_FILE) or {"version": _VERSION, "groups": {}, "stats": {}}
+    hasher = FileHasher(built["stats"])
+    groups = hash_inputs(hasher)
+    stages = dirty_stages(groups, built["groups"])
+    glyphs = dirty_glyphs(groups["svg"], built["groups"].get("svg", {}))
+    _save(
+        PENDING_FILE,
+        {
+            "version": _VERSION,
+            "groups": groups,
+            "stats": hasher.stats,
+            "stages": stages,
+            "glyphs": glyphs,
+        },
+    )
+
+    print(
+        "Dirty stages: %s.  Glyphs: %d changed, %d added, %d removed."
+        % (
+            ", ".join(stages) or "none",
+            len(glyphs["changed"]),
+            len(glyphs["added"]),
+            len(glyphs["removed"]),
+        ),
+        file=sys.stderr,
+    )
+    for stage in stages:
+        print(stage)
+
+
+def _pending():
+    pending = _load(PENDING_FILE)
+    if pending is None:
+        sys.exit("no plan, run '%s plan' first" % sys.argv[0])
+    return pending
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("command", choices=["plan", "glyphs", "removed", "commit"])
+    args = parser.parse_args()
+
+    if args.command == "plan":
+        plan()
+    elif args.command == "glyphs":
+        json.dump(_pending()["glyphs"], sys.stdout, indent=1)
+        print()
+    elif args.command == "removed":
+        for name in _pending()["glyphs"]["removed"]:
+            print(name)
+    elif args.command == "commit":
+        pending = _pending()
+        del pending["stages"]
+        del pending["glyphs"]
+        _save(STATE_FILE, pending)
+        os.remove(PENDING_FILE)
+
+
+if __name__ == "__main__":
+    main()
@@ -26,12 +26,16 @@ data so that it can reimport the svg, and we don't need it."""
 
 
 import argparse
-import codecs
+import collections
+import hashlib
+import json
 import logging
+import multiprocessing
 import os
 from os import path
 import re
 import sys
+import time
 
 from nototools import tool_utils
 
@@ -47,6 +51,33 @@ from xml.sax import saxutils
 # Use nodes instead of tuples and strings because it's easier to mutate
 # a tree of these, and cleaner will want to do this.
 
+_WHITESPACE_RE = re.compile(r'\s+')
+_TEXT_NEWLINES_RE = re.compile(r'[ \t]*\n+[ \t]*')
+_TEXT_SPACES_RE = re.compile(r'[ \t]+')
+# characters that saxutils.quoteattr escapes or that change its quoting
+_ATTR_SPECIAL_RE = re.compile(r'[&<>"\n\r\t]')
+
+
+def _quoteattr(v):
+  """saxutils.quoteattr, without its six replace calls for the common case
+  of a value that needs no escaping."""
+  if _ATTR_SPECIAL_RE.search(v):
+    return saxutils.quoteattr(v)
+  return '"%s"' % v
+
+
+def _svg_attr_order(k):
+  if k == 'width': return (0, None)
+  elif k == 'height': return (1, None)
+  else: return (2, k)
+
+
+def _attr_order(k):
+  if k == 'id': return (0, None)
+  elif k == 'class': return (1, None)
+  else: return (2, k)
+
+
 class _Elem_Node(object):
   def __init__(self, name, attrs, contents):
     self.name = name
@@ -106,7 +137,7 @@ class SvgCleaner(object):
     def _end_element(self, name):
       self._flush_textbuf()
       if len(self._stack) > 1:
-        self._stack = self._stack[:-1]
+        self._stack.pop()
 
     def _character_data(self, data):
       if len(self._stack):
@@ -125,6 +156,8 @@ class SvgCleaner(object):
       parser.StartElementHandler = self._start_element
       parser.EndElementHandler = self._end_element
       parser.CharacterDataHandler = self._character_data
+      # deliver runs of text in one call rather than line by line
+      parser.buffer_text = True
       self._reset(parser)
       parser.Parse(data)
       return self._stack[0]
@@ -150,7 +183,7 @@ class SvgCleaner(object):
             nattrs[k] = v
           logging.debug('removing %s=%s' % (k, v))
           continue
-        v = re.sub('\s+', ' ', v)
+        v = _WHITESPACE_RE.sub(' ', v)
         nattrs[k] = v
 
       if node.name == 'svg':
@@ -207,18 +240,24 @@ class SvgCleaner(object):
       # common case is text is empty (line endings between elements)
       if text:
         # main goal here is to leave linefeeds in for style elements
-        text = re.sub(r'[ \t]*\n+[ \t]*', '\n', text)
-        text = re.sub(r'[ \t]+', ' ', text)
+        text = _TEXT_NEWLINES_RE.sub('\n', text)
+        text = _TEXT_SPACES_RE.sub(' ', text)
       node.text = text
 
-    def clean(self, node):
-      if isinstance(node, _Text_Node):
-        self._clean_text(node)
-      else:
-        # do contents first, so we can check for empty subnodes after
-        for n in node.contents:
-          self.clean(n)
-        self._clean_elem(node)
+    def clean(self, root):
+      # Walk the tree with an explicit stack rather than recursion, so deeply
+      # nested files can't hit the recursion limit.  Contents are done first,
+      # so we can check for empty subnodes after.
+      stack = [(root, False)]
+      while stack:
+        node, contents_done = stack.pop()
+        if isinstance(node, _Text_Node):
+          self._clean_text(node)
+        elif contents_done:
+          self._clean_elem(node)
+        else:
+          stack.append((node, True))
+          stack.extend((n, False) for n in reversed(node.contents))
 
   class _Writer(object):
     """For text nodes, replaces sequences of whitespace with a single space.
@@ -228,51 +267,38 @@ class SvgCleaner(object):
       logging.warning('writer strip: %s' % strip);
       self._strip = strip
 
-    def _write_node(self, node, lines, indent):
-      """Node is a node generated by _Reader, either a TextNode or an
-      ElementNode. Lines is a list to collect the lines of output.  Indent is
-      the indentation level for this node."""
-
-      if isinstance(node, _Text_Node):
-        if node.text:
-          lines.append(node.text)
-      else:
-        margin = '' if self._strip else '  ' * indent
-        line = [margin]
-        line.append('<%s' % node.name)
-        # custom sort attributes of svg, yes this is a hack
-        if node.name == 'svg':
-          def svgsort(k):
-            if k == 'width': return (0, None)
-            elif k == 'height': return (1, None)
-            else: return (2, k)
-          ks = sorted(node.attrs.keys(), key=svgsort)
-        else:
-          def defsort(k):
-            if k == 'id': return (0, None)
-            elif k == 'class': return (1, None)
-            else: return (2, k)
-          ks = sorted(node.attrs.keys(), key=defsort)
-        for k in ks:
-          v = node.attrs[k]
-          line.append(' %s=%s' % (k, saxutils.quoteattr(v)))
-        if node.contents:
-          line.append('>')
-          lines.append(''.join(line))
-          for elem in node.contents:
-            self._write_node(elem, lines, indent + 1)
-          line = [margin]
-          line.append('</%s>' % node.name)
-          lines.append(''.join(line))
+    def _write_nodes(self, root, lines):
+      """Root is a node generated by _Reader, either a TextNode or an
+      ElementNode.  Lines is a list to collect the lines of output.  The tree
+      is walked with an explicit stack; closing tags are pushed as strings."""
+
+      stack = [(root, 0)]
+      while stack:
+        node, indent = stack.pop()
+        if isinstance(node, str):
+          lines.append(node)
+        elif isinstance(node, _Text_Node):
+          if node.text:
+            lines.append(node.text)
         else:
-          line.append('/>')
-          lines.append(''.join(line))
+          margin = '' if self._strip else '  ' * indent
+          # custom sort attributes of svg, yes this is a hack
+          order = _svg_attr_order if node.name == 'svg' else _attr_order
+          attrs = node.attrs
+          line = ''.join(
+              [margin, '<', node.name] +
+              [' %s=%s' % (k, _quoteattr(attrs[k]))
+               for k in sorted(attrs, key=order)])
+          if node.contents:
+            lines.append(line + '>')
+            stack.append((margin + '</%s>' % node.name, indent))
+            stack.extend((n, indent + 1) for n in reversed(node.contents))
+          else:
+            lines.append(line + '/>')
 
     def to_text(self, root):
-      # set up lines for recursive calls, let them append lines, then return
-      # the result.
       lines = []
-      self._write_node(root, lines, 0)
+      self._write_nodes(root, lines)
       return ''.join(lines) if self._strip else '\n'.join(lines)
 
   def tree_from_text(self, svg_text):
@@ -291,33 +317,130 @@ class SvgCleaner(object):
     return self.tree_to_text(tree)
 
 
-def clean_svg_files(in_dir, out_dir, match_pat=None, clean=False, strip=False):
+def _source_digest():
+  """Return a digest of this module, so files cleaned by another version of
+  the cleaner are cleaned again."""
+  with open(__file__, 'rb') as f:
+    return hashlib.sha256(f.read()).hexdigest()
+
+
+# Source hash of every svg whose cleaned output is up to date, kept in the
+# output directory.
+MANIFEST_NAME = '.svg_cleaner_manifest.json'
+
+CleanResult = collections.namedtuple(
+    'CleanResult', 'file_name seconds in_size out_size')
+
+_worker_cleaner = None
+
+
+def _init_worker(strip):
+  global _worker_cleaner
+  _worker_cleaner = SvgCleaner(strip)
+
+
+def _clean_file(args):
+  """Clean one file with the cleaner of this process and return a
+  CleanResult."""
+  file_name, in_path, out_path = args
+  start = time.time()
+  logging.debug('read: %s', in_path)
+  with open(in_path, 'rb') as in_fp:
+    data = in_fp.read()
+  # universal newlines, as the file used to be read in text mode
+  text = data.decode('utf-8').replace('\r\n', '\n').replace('\r', '\n')
+  result = _worker_cleaner.clean_svg(text).encode('utf-8')
+  logging.debug('write: %s', out_path)
+  with open(out_path, 'wb') as out_fp:
+    out_fp.write(result)
+  return CleanResult(file_name, time.time() - start, len(data), len(result))
+
+
+def _load_manifest(manifest_path):
+  try:
+    with open(manifest_path) as f:
+      return json.load(f)
+  except (OSError, ValueError):
+    return {}
+
+
+def clean_svg_files(
+    in_dir, out_dir, match_pat=None, clean=False, strip=False, jobs=1,
+    force=False):
+  """Clean the files in in_dir that match match_pat into out_dir, using jobs
+  worker processes.  Files whose source and cleaning options have not changed
+  since the last run, and whose output still exists, are skipped unless force
+  is set.  Returns a tuple of the CleanResults of the cleaned files and the
+  number of files skipped."""
   regex = re.compile(match_pat) if match_pat else None
-  count = 0
 
   if clean and path.samefile(in_dir, out_dir):
     logging.error('Cannot clean %s (same as in_dir)', out_dir)
-    return
+    return [], 0
 
   out_dir = tool_utils.ensure_dir_exists(out_dir, clean=clean)
+  manifest_path = os.path.join(out_dir, MANIFEST_NAME)
+  manifest = {} if force or clean else _load_manifest(manifest_path)
+  options = {'strip': strip, 'cleaner': _source_digest()}
 
-  cleaner = SvgCleaner(strip)
-  for file_name in os.listdir(in_dir):
+  hashes = {}
+  todo = []
+  for file_name in sorted(os.listdir(in_dir)):
     if regex and not regex.match(file_name):
       continue
     in_path = os.path.join(in_dir, file_name)
-    logging.debug('read: %s', in_path)
-    with open(in_path) as in_fp:
-      result = cleaner.clean_svg(in_fp.read())
     out_path = os.path.join(out_dir, file_name)
-    with codecs.open(out_path, 'w', 'utf-8') as out_fp:
-      logging.debug('write: %s', out_path)
-      out_fp.write(result)
-      count += 1
-  if not count:
+    if not path.isfile(in_path) or path.abspath(in_path) == path.abspath(manifest_path):
+      continue
+    with open(in_path, 'rb') as in_fp:
+      hashes[file_name] = hashlib.sha256(in_fp.read()).hexdigest()
+    entry = manifest.get(file_name)
+    if (entry == dict(options, sha256=hashes[file_name]) and
+        path.exists(out_path)):
+      continue
+    todo.append((file_name, in_path, out_path))
+  skipped = len(hashes) - len(todo)
+
+  results = []
+  try:
+    if jobs == 1:
+      _init_worker(strip)
+      results.extend(map(_clean_file, todo))
+    else:
+      pool = multiprocessing.Pool(jobs, _init_worker, (strip,))
+      with pool:
+        results.extend(pool.imap_unordered(_clean_file, todo, chunksize=8))
+  finally:
+    for result in results:
+      manifest[result.file_name] = dict(
+          options, sha256=hashes[result.file_name])
+    manifest = {k: v for k, v in manifest.items() if k in hashes}
+    with open(manifest_path, 'w') as f:
+      json.dump(manifest, f, indent=1, sort_keys=True)
+
+  if not hashes:
     logging.warning('Failed to match any files')
   else:
-    logging.info('Wrote %s files to %s', count, out_dir)
+    logging.info(
+        'Wrote %s files to %s, %s unchanged', len(results), out_dir, skipped)
+  return results, skipped
+
+
+def print_summary(results, skipped, out=sys.stdout):
+  """Print the clean time and size reduction of each file, slowest first,
+  and the totals."""
+  for r in sorted(results, key=lambda r: -r.seconds):
+    print('%-40s %7.1fms %8d -> %8d bytes (%5.1f%%)' % (
+        r.file_name, r.seconds * 1000, r.in_size, r.out_size,
+        100.0 * (r.in_size - r.out_size) / r.in_size if r.in_size else 0),
+          file=out)
+  in_size = sum(r.in_size for r in results)
+  out_size = sum(r.out_size for r in results)
+  print('cleaned %d files in %.2fs of worker time, %d unchanged; '
+        '%d -> %d bytes (%.1f%% smaller)' % (
+            len(results), sum(r.seconds for r in results), skipped, in_size,
+            out_size, 100.0 * (in_size - out_size) / in_size if in_size else 0),
+        file=out)
 
 
 def main():
@@ -338,6 +461,15 @@ def main():
   parser.add_argument(
       '-w', '--strip_whitespace', help='remove newlines and indentation',
       action='store_true')
+  parser.add_argument(
+      '-j', '--jobs', help='Number of worker processes, 0 for one per cpu.',
+      metavar='n', type=int, default=1)
+  parser.add_argument(
+      '-f', '--force', help='Clean files that have not changed.',
+      action='store_true')
+  parser.add_argument(
+      '-s', '--summary', help='Print the clean time and size of each file.',
+      action='store_true')
   args = parser.parse_args()
 
   tool_utils.setup_logging(args.loglevel)
@@ -348,9 +480,11 @@ def main():
     args.out_dir = args.in_dir + '_clean'
     logging.info('Writing output to %s', args.out_dir)
 
-  clean_svg_files(
+  results, skipped = clean_svg_files(
       args.in_dir, args.out_dir, match_pat=args.regex, clean=args.clean,
-      strip=args.strip_whitespace)
+      strip=args.strip_whitespace, jobs=args.jobs or None, force=args.force)
+  if args.summary:
+    print_summary(results, skipped)
 
 
 if __name__ == '__main__':
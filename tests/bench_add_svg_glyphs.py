@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+
+"""Time adding glyphs with add_svg_glyphs.FontBuilder.
+
+Half of the glyphs are single code points, a quarter are two code point
+ligatures, each of which also adds its second component.  With --baseline
+the glyph index lookup is the list search FontBuilder used before it kept
+a name to index map, for comparison.
+
+  tests/bench_add_svg_glyphs.py [--baseline] [COUNT...]
+"""
+
+import argparse
+from os import path
+import sys
+import time
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+
+from fontTools.ttLib import TTFont, newTable
+from fontTools.ttLib.tables._c_m_a_p import CmapSubtable
+
+import add_svg_glyphs
+
+
+def _list_glyph_name_to_index(self, name):
+    return self.glyph_order.index(name) if name in self.glyph_order else -1
+
+
+def make_font():
+    font = TTFont()
+    font.setGlyphOrder([".notdef"])
+    cmap = newTable("cmap")
+    cmap.tableVersion = 0
+    subtable = CmapSubtable.newSubtable(12)
+    subtable.platformID = 3
+    subtable.platEncID = 10
+    subtable.language = 0
+    subtable.cmap = {}
+    cmap.tables = [subtable]
+    font["cmap"] = cmap
+    hmtx = newTable("hmtx")
+    hmtx.metrics = {".notdef": (0, 0)}
+    font["hmtx"] = hmtx
+    return font
+
+
+def glyph_strings(count):
+    singles = [chr(0x10000 + i) for i in range(count // 2)]
+    ligatures = [chr(0x10000 + i) + chr(0x20000 + i) for i in range(count // 4)]
+    return singles + ligatures
+
+
+def bench(count):
+    builder = add_svg_glyphs.FontBuilder(make_font())
+    builder.init_gsub()
+    builder.init_glyf()
+    strings = glyph_strings(count)
+    start = time.time()
+    for s in strings:
+        builder.add_components_and_ligature(s)
+    return len(builder.glyph_order), time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--baseline", help="look glyph indices up in the glyph order list",
+        action="store_true",
+    )
+    parser.add_argument(
+        "counts", help="glyph counts (default 4000 40000)", metavar="count",
+        type=int, nargs="*", default=[4000, 40000],
+    )
+    args = parser.parse_args()
+    if args.baseline:
+        add_svg_glyphs.FontBuilder.glyph_name_to_index = _list_glyph_name_to_index
+
+    print("glyphs   seconds")
+    for count in args.counts:
+        glyphs, seconds = bench(count)
+        print("%-8d %7.2f" % (glyphs, seconds))
+
+
+if __name__ == "__main__":
+    main()
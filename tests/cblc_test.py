@@ -0,0 +1,78 @@
+from fontTools import ttLib
+import pytest
+
+import emoji_builder
+from png_index import PNGIndex
+
+
+# Glyphs with the same image as another glyph of the images fixture, mapped
+# to that glyph, to check that the dedup option points them at one copy.
+SHARED_IMAGES = {10: 2, 60: 2, 110: 30, 121: 120}
+
+
+def build_strike(tmp_path, make_font, write_png, images, options):
+    img_files = {f"g{i}": str(write_png(i, **how)) for i, how in images.items()}
+    font = make_font(max(images) + 1)
+    emoji_builder.add_strikes(font, [str(tmp_path / "emoji_u")], options)
+    font_file = tmp_path / "test.ttf"
+    font.save(font_file)
+    return ttLib.TTFont(font_file), img_files
+
+
+def expected_image(img_file):
+    _, _, png_data = emoji_builder.load_png_record(img_file, PNGIndex().info(img_file))
+    return bytes(png_data)
+
+
+def read_strike(font):
+    """Return the index formats, glyph name to image data map and glyph name
+    to image location map of the only strike in font."""
+    index_subtables = font["CBLC"].strikes[0].indexSubTables
+    formats = {subtable.indexFormat for subtable in index_subtables}
+    locations = {}
+    for subtable in index_subtables:
+        locations.update(zip(subtable.names, subtable.locations))
+    images = {
+        name: glyph.imageData for name, glyph in font["CBDT"].strikeData[0].items()
+    }
+    return formats, images, locations
+
+
+@pytest.mark.parametrize(
+    "options",
+    [("small_glyph_metrics",), ("small_glyph_metrics", "parallel")],
+)
+def test_index_formats_round_trip(tmp_path, make_font, write_png, images, options):
+    font, img_files = build_strike(tmp_path, make_font, write_png, images, options)
+    formats, image_data, _ = read_strike(font)
+    assert formats == {1, 3, 4}
+    assert image_data == {name: expected_image(f) for name, f in img_files.items()}
+
+
+def test_index_format_1_option(tmp_path, make_font, write_png, images):
+    font, img_files = build_strike(
+        tmp_path, make_font, write_png, images, ("small_glyph_metrics", "index_format_1")
+    )
+    formats, image_data, _ = read_strike(font)
+    assert formats == {1}
+    assert image_data == {name: expected_image(f) for name, f in img_files.items()}
+
+
+@pytest.mark.parametrize(
+    "options",
+    [
+        ("small_glyph_metrics", "dedup"),
+        ("small_glyph_metrics", "dedup", "parallel"),
+    ],
+)
+def test_dedup_round_trip(tmp_path, make_font, write_png, images, options):
+    shared = {i: images[original] for i, original in SHARED_IMAGES.items()}
+    font, img_files = build_strike(
+        tmp_path, make_font, write_png, {**images, **shared}, options
+    )
+    formats, image_data, locations = read_strike(font)
+    assert formats == {1, 3, 4}
+    assert image_data == {name: expected_image(f) for name, f in img_files.items()}
+    for i, original in SHARED_IMAGES.items():
+        assert locations[f"g{i}"] == locations[f"g{original}"]
+    assert len(set(locations.values())) == len(images)
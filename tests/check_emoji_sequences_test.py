@@ -0,0 +1,75 @@
+from os import path
+import json
+
+import check_emoji_sequences
+
+
+# Names that pass every check but coverage: a single emoji, a country flag,
+# a keycap, a subdivision flag (black flag and tags) and a modifier base
+# with all its skin tones.
+VALID_NAMES = [
+    "emoji_u1f600.png",
+    "emoji_u1f1fa_1f1f8.png",
+    "emoji_u0023_20e3.png",
+    "emoji_u1f3f4_e0067_e0062_e0065_e006e_e0067_e007f.png",
+    "emoji_u1f44d.png",
+    *(f"emoji_u1f44d_{tone:x}.png" for tone in range(0x1F3FB, 0x1F400)),
+]
+
+# Names with problems that are reported but do not fail the check, and the
+# checks that report them.
+WARNING_NAMES = {
+    "emoji_u2764_fe0f.png": {"no_vs"},
+    "emoji_u200d_1f600.png": {"zwj", "zwj_sequences"},
+    "emoji_u1f1fa_1f1f8_1f1e6.png": {"flags"},
+    "emoji_u1f600_1f3fb.png": {"skintone"},
+}
+
+
+def run_json(capsys, tmp_path, names):
+    for name in names:
+        (tmp_path / name).touch()
+    try:
+        check_emoji_sequences.run_check(
+            [str(tmp_path)], None, "emoji_u", ".png", None, None, False,
+            json_output=True,
+        )
+        status = 0
+    except SystemExit as e:
+        status = e.code
+    out = capsys.readouterr().out
+    return status, json.loads(out)
+
+
+def test_json_valid(capsys, tmp_path):
+    status, result = run_json(capsys, tmp_path, VALID_NAMES)
+    assert status == 0
+    assert result == {
+        "sequences": len(VALID_NAMES),
+        "passed": True,
+        "diagnostics": [],
+    }
+
+
+def test_json_warnings(capsys, tmp_path):
+    status, result = run_json(capsys, tmp_path, VALID_NAMES + list(WARNING_NAMES))
+    assert status == 0
+    assert result["passed"]
+    assert result["sequences"] == len(VALID_NAMES) + len(WARNING_NAMES)
+    found = {}
+    for d in result["diagnostics"]:
+        assert not d["fatal"]
+        assert path.dirname(d["path"]) == str(tmp_path)
+        found.setdefault(path.basename(d["path"]), set()).add(d["check"])
+    assert found == WARNING_NAMES
+
+
+def test_json_invalid_cp(capsys, tmp_path):
+    status, result = run_json(capsys, tmp_path, VALID_NAMES + ["emoji_u0041.png"])
+    assert status == 1
+    assert not result["passed"]
+    assert {d["check"] for d in result["diagnostics"]} == {"valid_emoji_cps"}
+    assert all(d["fatal"] for d in result["diagnostics"])
+    assert str(tmp_path / "emoji_u0041.png") in [
+        d["path"] for d in result["diagnostics"]
+    ]
@@ -0,0 +1,76 @@
+from fontTools.fontBuilder import FontBuilder
+from fontTools.pens.ttGlyphPen import TTGlyphPen
+from pathlib import Path
+from PIL import Image
+import pytest
+import random
+import sys
+
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path[:0] = [str(ROOT), str(ROOT / "third_party" / "color_emoji")]
+
+# The first code point of the test fonts, glyph "g<i>" is mapped to
+# FIRST_CP + i.
+FIRST_CP = 0xE000
+IMAGE_SIZE = (136, 128)
+
+# How the image of each glyph of the test strikes is made, see write_png.
+# Glyphs 0-9 are a run of small images, which index format 3 covers best,
+# the glyphs from 30 a sparse run for format 4, and glyph 120 has an image
+# of more than 64K, which only format 1 can point at.
+IMAGES = {
+    **{i: {"color": (20 * i, 0, 0, 255)} for i in range(10)},
+    **{i: {"color": (0, i, 0, 255)} for i in range(30, 100, 20)},
+    120: {"noise_seed": 1},
+}
+
+
+@pytest.fixture
+def make_font():
+    """Return a function that makes a font with glyphs g0 .. g<count - 1>
+    mapped to FIRST_CP onwards, ready for emoji_builder.add_strikes."""
+
+    def make(count):
+        glyphs = [".notdef"] + [f"g{i}" for i in range(count)]
+        fb = FontBuilder(2048, isTTF=True)
+        fb.setupGlyphOrder(glyphs)
+        fb.setupCharacterMap({FIRST_CP + i: f"g{i}" for i in range(count)})
+        empty = TTGlyphPen(None).glyph()
+        fb.setupGlyf({name: empty for name in glyphs})
+        fb.setupHorizontalMetrics({name: (2550, 0) for name in glyphs})
+        fb.setupHorizontalHeader(ascent=1900, descent=-500)
+        fb.setupOS2()
+        fb.setupPost()
+        fb.setupNameTable({"familyName": "Test", "styleName": "Regular"})
+        return fb.font
+
+    return make
+
+
+@pytest.fixture
+def write_png(tmp_path):
+    """Return a function that writes the image for glyph i to tmp_path and
+    returns its file name.  A color gives a small flat image, noise an image
+    of more than 64K."""
+
+    def write(i, color=None, noise_seed=None, prefix="emoji_u"):
+        if noise_seed is not None:
+            rnd = random.Random(noise_seed)
+            image = Image.frombytes(
+                "RGBA", IMAGE_SIZE, rnd.randbytes(4 * IMAGE_SIZE[0] * IMAGE_SIZE[1])
+            )
+        else:
+            image = Image.new("RGBA", IMAGE_SIZE, color)
+        img_file = tmp_path / f"{prefix}{FIRST_CP + i:x}.png"
+        image.save(img_file)
+        return img_file
+
+    return write
+
+
+@pytest.fixture
+def images():
+    """Return a map of glyph index to the write_png arguments of its image,
+    for a strike that needs index formats 1, 3 and 4."""
+    return dict(IMAGES)
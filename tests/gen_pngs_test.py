@@ -0,0 +1,30 @@
+from pathlib import Path
+import pytest
+
+try:
+    import cairosvg
+    import gen_pngs
+except (ImportError, OSError):  # cairosvg needs the cairo library
+    cairosvg = None
+
+pytestmark = pytest.mark.skipif(cairosvg is None, reason="needs cairosvg and cairo")
+
+SVG_DIR = Path(__file__).resolve().parent.parent / "svg"
+
+
+# A plain emoji, and one with use elements, which cairosvg rewrites in the
+# tree while drawing it.
+@pytest.mark.parametrize("filename", ["emoji_u1f600.svg", "emoji_u1f301.svg"])
+def test_render_svg_matches_svg2png(tmp_path, monkeypatch, filename):
+    monkeypatch.setattr(gen_pngs, "svg_dir", str(SVG_DIR))
+    monkeypatch.setattr(gen_pngs, "output_base_dir", str(tmp_path))
+    for dim in gen_pngs.dimensions:
+        (tmp_path / str(dim)).mkdir()
+
+    _, ok, _, messages = gen_pngs.render_svg(filename)
+    assert ok, messages
+    for dim in gen_pngs.dimensions:
+        expected = cairosvg.svg2png(
+            url=str(SVG_DIR / filename), output_width=dim, output_height=dim
+        )
+        assert Path(gen_pngs.output_path(filename, dim)).read_bytes() == expected
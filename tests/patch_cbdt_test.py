@@ -0,0 +1,65 @@
+from fontTools import ttLib
+import pytest
+
+import emoji_builder
+import patch_cbdt
+
+
+# New images for a glyph in each index subtable of the images fixture.
+PATCHES = {
+    2: {"color": (0, 0, 200, 255)},
+    50: {"color": (0, 0, 100, 255)},
+    120: {"noise_seed": 2},
+}
+
+OPTIONS = ("small_glyph_metrics",)
+
+
+def build_font(tmp_path, make_font, count, options, name):
+    font = make_font(count)
+    emoji_builder.add_strikes(font, [str(tmp_path / "emoji_u")], options)
+    font_file = tmp_path / name
+    font.save(font_file)
+    return font_file
+
+
+def read_images(font_file):
+    font = ttLib.TTFont(font_file)
+    return {
+        name: glyph.imageData for name, glyph in font["CBDT"].strikeData[0].items()
+    }
+
+
+@pytest.mark.parametrize("options", [OPTIONS, OPTIONS + ("dedup",)])
+def test_patch_matches_rebuild(tmp_path, make_font, write_png, images, options):
+    for i, how in images.items():
+        write_png(i, **how)
+    count = max(images) + 1
+    built_file = build_font(tmp_path, make_font, count, options, "built.ttf")
+
+    font = ttLib.TTFont(built_file)
+    strikes = patch_cbdt.read_strikes(font.getTableData("CBLC"))
+    assert {s.indexFormat for s in font["CBLC"].strikes[0].indexSubTables} == {1, 3, 4}
+    assert len(strikes) == 1
+    assert [gmap.glyph for gmap in strikes[0].glyph_maps[:-1]] == [
+        font.getGlyphID(f"g{i}") for i in sorted(images)
+    ]
+
+    img_files = {}
+    for i, how in PATCHES.items():
+        img_file = write_png(i, **how)
+        img_files[emoji_builder.image_file_chars(img_file.name, "emoji_u")] = str(
+            img_file
+        )
+    patch_cbdt.patch_strikes(font, img_files, options)
+    patched_file = tmp_path / "patched.ttf"
+    font.save(patched_file)
+
+    rebuilt_file = build_font(tmp_path, make_font, count, options, "rebuilt.ttf")
+    patched_images = read_images(patched_file)
+    assert patched_images == read_images(rebuilt_file)
+    assert patched_images != read_images(built_file)
+    # emoji_builder would have written the same tables
+    patched, rebuilt = ttLib.TTFont(patched_file), ttLib.TTFont(rebuilt_file)
+    for tag in ("CBDT", "CBLC"):
+        assert patched.getTableData(tag) == rebuilt.getTableData(tag)
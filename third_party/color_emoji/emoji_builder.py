@@ -20,25 +20,34 @@
 
 from __future__ import print_function
 import sys, struct
-from png import PNG
+import glob
+import hashlib
+import time
+from png import PNG, MappedPNG
+from png_index import PNGIndex
+from font_splice import FileStream, add_placeholder_table, save_with_table
+import functools
+import multiprocessing
 import os
+import tempfile
 from os import path
 
+from fontTools import ttLib
 from nototools import font_data
 
+sys.path.append (path.join (path.dirname (path.abspath (__file__)), os.pardir, os.pardir))
+from ligature_index import LigatureIndex
+
 
 try:
 	unichr  # py2
 except NameError:
 	unichr = chr  # py3
 
-def get_glyph_name_from_gsub (string, font, cmap_dict):
-	ligatures = font['GSUB'].table.LookupList.Lookup[0].SubTable[0].ligatures
-	first_glyph = cmap_dict[ord (string[0])]
-	rest_of_glyphs = [cmap_dict[ord (ch)] for ch in string[1:]]
-	for ligature in ligatures[first_glyph]:
-		if ligature.Component == rest_of_glyphs:
-			return ligature.LigGlyph
+try:
+	import numpy
+except ImportError:
+	numpy = None
 
 
 def div (a, b):
@@ -51,26 +60,110 @@ class FontMetrics:
 		self.descent = descent
 
 class StrikeMetrics:
-	def __init__ (self, font_metrics, advance, bitmap_width, bitmap_height):
+	def __init__ (self, font_metrics, advance, bitmap_width, bitmap_height, ppem = None):
 		self.width = bitmap_width # in pixels
 		self.height = bitmap_height # in pixels
 		self.advance = advance # in font units
-		self.x_ppem = self.y_ppem = div (bitmap_width * font_metrics.upem, advance)
+		if ppem == None:
+			ppem = div (bitmap_width * font_metrics.upem, advance)
+		self.x_ppem = self.y_ppem = ppem
+
+def load_png_record (img_file, info, keep_chunks = False):
+	"""Return (width, height, png_data) for img_file, using the header and
+	chunk layout in info (a png_index.PNGInfo).  The chunks that CBDT does not
+	need are dropped unless keep_chunks is set.  This is a module level
+	function so that it can run in a worker process."""
+	with open (img_file, 'rb') as f:
+		data = f.read ()
+	if keep_chunks:
+		png_data = bytearray (data)
+	else:
+		png_data = info.filter (data, CBDT.png_allowed_chunks)
+	return info.width, info.height, png_data
+
+
+def _load_png_record_args (args, keep_chunks):
+	return load_png_record (*args, keep_chunks = keep_chunks)
+
+
+def record_key (width, height, *png_data):
+	"""Return the key under which the dedup option looks up an image of the
+	given size, whose data is the concatenation of png_data."""
+	h = hashlib.sha256 ()
+	for data in png_data:
+		h.update (data)
+	return width, height, h.digest ()
+
+
+def format1_pixels (data, width, height, stride):
+	"""Return the pixels of a cairo ARGB32 image, given as rows of stride
+	bytes of native endian 32 bit words, as little endian words without
+	row padding, the layout of imageFormat 1."""
+
+	if sys.byteorder == "little" and stride == width * 4:
+		# Sweet.  Data is in desired format, ship it!
+		return bytes (data)
+
+	if numpy != None:
+		# Drop the row padding and byte swap the whole image at once
+		rows = numpy.frombuffer (data, dtype = numpy.uint8, count = height * stride)
+		rows = rows.reshape (height, stride)[:, :width * 4]
+		pixels = numpy.ascontiguousarray (rows).view ("=u4")
+		return pixels.astype ("<u4").tobytes ()
+
+	# Unexpected stride or endianness, convert a row at a time
+	pixels = bytearray ()
+	for y in range (height):
+		row = data[y * stride:y * stride + width * 4]
+		pixels.extend (struct.pack ("<%dI" % width, *struct.unpack ("=%dI" % width, row)))
+	return bytes (pixels)
+
+
+def decode_format1 (png):
+	"""Return (width, height, pixel_data) of a PNG object in the layout of
+	imageFormat 1."""
+
+	import cairo
+	img = cairo.ImageSurface.create_from_png (png.stream ())
+	if img.get_format () != cairo.FORMAT_ARGB32:
+		raise Exception ("Expected FORMAT_ARGB32, but image has format %d" % img.get_format ())
+
+	width = img.get_width ()
+	height = img.get_height ()
+	img.flush ()
+	return width, height, format1_pixels (img.get_data (), width, height, img.get_stride ())
+
+
+def load_format1_record (img_file):
+	"""decode_format1 for an image file.  This is a module level function
+	so that it can run in a worker process."""
+	with PNG (img_file) as png:
+		return decode_format1 (png)
+
 
 class GlyphMap:
-	def __init__ (self, glyph, offset, image_format):
+	def __init__ (self, glyph, offset, image_format, size = None):
 		self.glyph = glyph
 		self.offset = offset
 		self.image_format = image_format
+		# size of the image data; None until the end of the strike, where
+		# it is taken to run up to the offset of the next glyph
+		self.size = size
 
 
 # Based on http://www.microsoft.com/typography/otspec/ebdt.htm
 class CBDT:
 
-	def __init__ (self, font_metrics, options = (), stream = None):
+	def __init__ (self, font_metrics, options = (), stream = None, png_index = None, records = None):
 		self.stream = stream if stream != None else bytearray ()
 		self.options = options
 		self.font_metrics = font_metrics
+		self.png_index = png_index if png_index != None else PNGIndex ()
+		# optional dict from image file to (width, height, png_data), shared
+		# by builders with the same keep_chunks option.
+		self.records = records
+		# bytes of image data not written because of the dedup option
+		self.dedup_saved = 0
 		self.base_offset = 0
 		self.base_offset = self.tell ()
 
@@ -87,23 +180,108 @@ class CBDT:
 	def start_strike (self, strike_metrics):
 		self.strike_metrics = strike_metrics
 		self.glyph_maps = []
+		# key -> (offset, size) of the image data written in this strike
+		self.blobs = {}
+
+	def add_glyph (self, glyph, image_format, key, write, *args):
+		"""Write the image data of glyph with write (*args).  If key is not
+		None and an image with the same key was written earlier in this
+		strike, the glyph points at that copy instead."""
+		blob = self.blobs.get (key) if key != None else None
+		if blob == None:
+			offset = self.tell ()
+			write (*args)
+			blob = (offset, self.tell () - offset)
+			if key != None:
+				self.blobs[key] = blob
+		else:
+			self.dedup_saved += blob[1]
+		self.glyph_maps.append (GlyphMap (glyph, blob[0], image_format, blob[1]))
 
 	def write_glyphs (self, glyphs, glyph_filenames, image_format):
 
+		if self.records != None and image_format in (17, 18):
+			self.write_glyphs_shared (glyphs, glyph_filenames, image_format)
+			return
+
+		if 'parallel' in self.options and image_format in (1, 17, 18):
+			self.write_glyphs_parallel (glyphs, glyph_filenames, image_format)
+			return
+
 		write_func = self.image_write_func (image_format)
 		for glyph in glyphs:
 			img_file = glyph_filenames[glyph]
                         # print 'writing data for glyph %s' % path.basename(img_file)
+			if image_format in (17, 18):
+				self.add_mapped_png (glyph, img_file, image_format)
+				continue
 			offset = self.tell ()
-			write_func (PNG (img_file))
+			with PNG (img_file) as png:
+				write_func (png)
 			self.glyph_maps.append (GlyphMap (glyph, offset, image_format))
 
+	def write_glyphs_parallel (self, glyphs, glyph_filenames, image_format):
+
+		# Loading and filtering the PNGs, or decoding them for imageFormat
+		# 1, is the expensive part, so farm that out to a process pool.
+		# imap hands the results back in glyph order, and the records are
+		# written exactly as the serial path would.
+		img_files = [glyph_filenames[glyph] for glyph in glyphs]
+		if image_format == 1:
+			load = load_format1_record
+			args = img_files
+			write = self.write_format1_record
+		else:
+			big_metrics = image_format == 18
+			load = functools.partial (_load_png_record_args,
+						  keep_chunks = 'keep_chunks' in self.options)
+			args = [(img_file, self.png_index.info (img_file)) for img_file in img_files]
+			write = lambda width, height, png_data: self.write_png_record (
+				width, height, png_data, big_metrics)
+		dedup = 'dedup' in self.options and image_format != 1
+		with multiprocessing.Pool () as pool:
+			records = pool.imap (load, args, chunksize = 16)
+			for glyph, record in zip (glyphs, records):
+				key = record_key (*record) if dedup else None
+				self.add_glyph (glyph, image_format, key, write, *record)
+
+	def write_glyphs_shared (self, glyphs, glyph_filenames, image_format):
+
+		# Load the images that are not in the shared records yet, then write
+		# every glyph from the records, so a later build with the same
+		# images does not read them again.  With the dedup option, glyphs
+		# whose record is the same as that of an earlier glyph share its
+		# image data.
+		big_metrics = image_format == 18
+		keep_chunks = 'keep_chunks' in self.options
+		img_files = [glyph_filenames[glyph] for glyph in glyphs]
+		missing = [img_file for img_file in dict.fromkeys (img_files)
+			   if img_file not in self.records]
+		args = [(img_file, self.png_index.info (img_file)) for img_file in missing]
+		load = functools.partial (_load_png_record_args, keep_chunks = keep_chunks)
+		if 'parallel' in self.options and len (missing) > 1:
+			with multiprocessing.Pool () as pool:
+				self.records.update (zip (missing, pool.imap (load, args, chunksize = 16)))
+		else:
+			self.records.update (zip (missing, map (load, args)))
+
+		dedup = 'dedup' in self.options
+		for glyph, img_file in zip (glyphs, img_files):
+			width, height, png_data = self.records[img_file]
+			key = record_key (width, height, png_data) if dedup else None
+			self.add_glyph (glyph, image_format, key, self.write_png_record,
+					width, height, png_data, big_metrics)
+
 	def end_strike (self):
 
 		self.glyph_maps.append (GlyphMap (None, self.tell (), None))
 		glyph_maps = self.glyph_maps
+		for gmap, next_gmap in zip (glyph_maps, glyph_maps[1:]):
+			if gmap.size == None:
+				gmap.size = next_gmap.offset - gmap.offset
 		del self.glyph_maps
 		del self.strike_metrics
+		del self.blobs
 		return glyph_maps
 
 	def write_glyphMetrics (self, width, height, big_metrics):
@@ -157,33 +335,11 @@ class CBDT:
 		      e, height, width, x_bearing, y_bearing, advance))
 
 	def write_format1 (self, png):
+		self.write_format1_record (*decode_format1 (png))
 
-		import cairo
-		img = cairo.ImageSurface.create_from_png (png.stream ())
-		if img.get_format () != cairo.FORMAT_ARGB32:
-			raise Exception ("Expected FORMAT_ARGB32, but image has format %d" % img.get_format ())
-
-		width = img.get_width ()
-		height = img.get_height ()
-		stride = img.get_stride ()
-		data = img.get_data ()
-
-		self.write_smallGlyphMetrics (width, height)
-
-		if sys.byteorder == "little" and stride == width * 4:
-			# Sweet.  Data is in desired format, ship it!
-			self.write (data)
-			return
-
-		# Unexpected stride or endianness, do it the slow way
-		offset = 0
-		for y in range (height):
-			for x in range (width):
-				pixel = data[offset + 4 * x: offset + 4 * (x + 1)]
-				# Convert to little endian
-				pixel = struct.pack ("<I", struct.unpack ("@I", pixel)[0])
-				self.write (pixel)
-			offset += stride
+	def write_format1_record (self, width, height, pixel_data):
+		self.write_glyphMetrics (width, height, False)
+		self.write (pixel_data)
 
 	png_allowed_chunks =  [b"IHDR", b"PLTE", b"tRNS", b"sRGB", b"IDAT", b"IEND"]
 
@@ -199,9 +355,43 @@ class CBDT:
 		if 'keep_chunks' not in self.options:
 			png = png.filter_chunks (self.png_allowed_chunks)
 
+		self.write_png_record (width, height, png.data (), big_metrics)
+
+	def add_mapped_png (self, glyph, img_file, image_format):
+		# Copy the chunks we keep straight from the mapped file into the
+		# stream, using the chunk layout from the index.  With the dedup
+		# option only the key of each image is kept, not its data.
+		info = self.png_index.info (img_file)
+		with MappedPNG (img_file) as png:
+			data = png.data ()
+			if 'keep_chunks' in self.options:
+				chunks = [data[len (PNG.signature):]]
+			else:
+				chunks = [data[start:end] for chunk_type, start, end in info.chunks
+					  if chunk_type in self.png_allowed_chunks]
+			try:
+				key = None
+				if 'dedup' in self.options:
+					key = record_key (info.width, info.height, PNG.signature, *chunks)
+				self.add_glyph (glyph, image_format, key, self.write_png_chunks,
+						info.width, info.height, chunks, image_format == 18)
+			finally:
+				# the map can't be closed while slices of it are alive
+				for chunk in chunks:
+					chunk.release ()
+
+	def write_png_chunks (self, width, height, chunks, big_metrics):
+		self.write_glyphMetrics (width, height, big_metrics)
+
+		# ULONG data length
+		self.write (struct.pack(">L", len (PNG.signature) + sum (len (chunk) for chunk in chunks)))
+		self.write (PNG.signature)
+		for chunk in chunks:
+			self.write (chunk)
+
+	def write_png_record (self, width, height, png_data, big_metrics):
 		self.write_glyphMetrics (width, height, big_metrics)
 
-		png_data = png.data ()
 		# ULONG data length
 		self.write (struct.pack(">L", len (png_data)))
 		self.write (png_data)
@@ -213,6 +403,100 @@ class CBDT:
 		return None
 
 
+# Index subtable runs are (index_format, start, end) tuples, covering
+# glyph_maps[start:end].  The index only has an offset for each glyph, so
+# the image data of the glyphs in a run has to follow on from one glyph to
+# the next.  Glyphs that share the image of an earlier glyph are split off
+# into runs of their own.
+
+def glyph_maps_chained (glyph_maps, i):
+	"""Whether glyph i + 1 can be in the same run as glyph i."""
+	gmap = glyph_maps[i]
+	next_gmap = glyph_maps[i + 1]
+	return (next_gmap.image_format == gmap.image_format and
+		next_gmap.offset == gmap.offset + gmap.size)
+
+def index_subtable_size (index_format, glyph_maps, start, end):
+	"""Return the size of an index subtable and its array entry."""
+	glyphs = glyph_maps[end - 1].glyph - glyph_maps[start].glyph + 1
+	if index_format == 1:
+		return 8 + 8 + 4 * (glyphs + 1)
+	if index_format == 3:
+		return 8 + 8 + (2 * (glyphs + 1) + 3) // 4 * 4
+	if index_format == 4:
+		return 8 + 12 + 4 * (end - start + 1)
+	raise ValueError ("index subtable format %d is not supported" % index_format)
+
+def index_runs_size (runs, glyph_maps):
+	return sum (index_subtable_size (index_format, glyph_maps, start, end)
+		    for index_format, start, end in runs)
+
+def format1_index_runs (glyph_maps):
+	"""Split glyph_maps at every glyph id gap, image format change and
+	shared image, all in index format 1.  This is the layout older builds
+	wrote."""
+	runs = []
+	start = 0
+	for i in range (1, len (glyph_maps)):
+		if (i == len (glyph_maps) - 1 or
+		    glyph_maps[i].glyph != glyph_maps[i - 1].glyph + 1 or
+		    not glyph_maps_chained (glyph_maps, i - 1)):
+			runs.append ((1, start, i))
+			start = i
+	return runs
+
+def compact_index_runs (glyph_maps):
+	"""Split glyph_maps into the runs, and pick the index format of each,
+	that make the smallest index.
+
+	Format 1 has 32 bit offsets for every glyph from the first to the last
+	of its run, format 3 the same with 16 bit offsets, and format 4 16 bit
+	offsets and glyph ids for only the glyphs with images.  Formats 3 and 4
+	can only cover 64K of image data.  Formats 2 and 5 are for images that
+	all have the same size and metrics, which PNG images do not.
+
+	best[j] is the smallest size of an index for the first j glyphs.  A
+	run ending at glyph j - 1 can start at any earlier glyph it is chained
+	to; for format 1 the smallest size over all of those starts is kept as
+	it goes, and formats 3 and 4 only look back as far as 64K of image
+	data."""
+
+	n = len (glyph_maps) - 1
+	best = [0] + [None] * n
+	choice = [None] * (n + 1)
+	format1_start = None # (best[i] - 4 * glyph of i, i)
+	for j in range (1, n + 1):
+		last = glyph_maps[j - 1]
+		if j == 1 or not glyph_maps_chained (glyph_maps, j - 2):
+			format1_start = None
+		value = best[j - 1] - 4 * last.glyph
+		if format1_start == None or value < format1_start[0]:
+			format1_start = (value, j - 1)
+		best[j] = format1_start[0] + 8 + 8 + 4 * (last.glyph + 2)
+		choice[j] = (1, format1_start[1])
+
+		end_offset = last.offset + last.size
+		for i in range (j - 1, -1, -1):
+			if i < j - 1 and not glyph_maps_chained (glyph_maps, i):
+				break
+			if end_offset - glyph_maps[i].offset > 0xFFFF:
+				break
+			for index_format in (3, 4):
+				size = best[i] + index_subtable_size (index_format, glyph_maps, i, j)
+				if size < best[j]:
+					best[j] = size
+					choice[j] = (index_format, i)
+
+	runs = []
+	j = n
+	while j:
+		index_format, i = choice[j]
+		runs.append ((index_format, i, j))
+		j = i
+	runs.reverse ()
+	return runs
+
+
 # Based on http://www.microsoft.com/typography/otspec/eblc.htm
 class CBLC:
 
@@ -292,59 +576,74 @@ class CBLC:
 	def write_sbitLineMetrics_vert (self):
 		self.write_sbitLineMetrics_hori () # XXX
 
-	def write_indexSubTable1 (self, glyph_maps):
+	def write_indexSubTable (self, index_format, glyph_maps):
+		"""Write one index subtable for glyph_maps, a run of glyphs whose
+		image data is chained.  Formats 1 and 3 cover every glyph from the
+		first to the last; glyphs without an image get a zero length
+		entry."""
 
 		image_format = glyph_maps[0].image_format
 
-		self.write (struct.pack(">H", 1)) # USHORT indexFormat
+		self.write (struct.pack(">H", index_format)) # USHORT indexFormat
 		self.write (struct.pack(">H", image_format)) # USHORT imageFormat
 		imageDataOffset = glyph_maps[0].offset
 		self.write (struct.pack(">L", imageDataOffset)) # ULONG imageDataOffset
-		for gmap in glyph_maps[:-1]:
-			self.write (struct.pack(">L", gmap.offset - imageDataOffset)) # ULONG offsetArray
-			assert gmap.image_format == image_format
-		self.write (struct.pack(">L", glyph_maps[-1].offset - imageDataOffset))
+		for i in range (len (glyph_maps) - 1):
+			assert glyph_maps_chained (glyph_maps, i)
+		end = glyph_maps[-1].offset + glyph_maps[-1].size - imageDataOffset
+
+		if index_format == 4:
+			# ULONG numGlyphs, then a USHORT glyphID, USHORT offset pair
+			# for each glyph and one to end the last image
+			self.write (struct.pack(">L", len (glyph_maps)))
+			for gmap in glyph_maps:
+				self.write (struct.pack(">HH", gmap.glyph, gmap.offset - imageDataOffset))
+			self.write (struct.pack(">HH", 0, end))
+			return
+
+		offsets = []
+		glyph = glyph_maps[0].glyph
+		for gmap in glyph_maps:
+			while glyph < gmap.glyph:
+				offsets.append (gmap.offset - imageDataOffset)
+				glyph += 1
+			offsets.append (gmap.offset - imageDataOffset)
+			glyph += 1
+		offsets.append (end)
+		if index_format == 1:
+			self.write (struct.pack(">%dL" % len (offsets), *offsets)) # ULONG offsetArray
+		elif index_format == 3:
+			# USHORT offsetArray, padded to a 4 byte boundary
+			if len (offsets) % 2:
+				offsets.append (0)
+			self.write (struct.pack(">%dH" % len (offsets), *offsets))
+		else:
+			raise ValueError ("index subtable format %d is not supported" % index_format)
+
+	def write_indexSubTable1 (self, glyph_maps):
+		self.write_indexSubTable (1, glyph_maps)
 
 	def write_bitmapSizeTable (self, glyph_maps):
 
-		# count number of ranges
-		count = 1
-		start = glyph_maps[0].glyph
-		last_glyph = start
-		last_image_format = glyph_maps[0].image_format
-		for gmap in glyph_maps[1:-1]:
-			if last_glyph + 1 != gmap.glyph or last_image_format != gmap.image_format:
-				count += 1
-			last_glyph = gmap.glyph
-			last_image_format = gmap.image_format
-		headersLen = count * 8
+		if 'index_format_1' in self.options:
+			runs = format1_index_runs (glyph_maps)
+		else:
+			runs = compact_index_runs (glyph_maps)
+		self.index_format1_size = index_runs_size (format1_index_runs (glyph_maps), glyph_maps)
+		headersLen = len (runs) * 8
 
 		headers = bytearray ()
 		subtables = bytearray ()
-		start = glyph_maps[0].glyph
-		start_id = 0
-		last_glyph = start
-		last_image_format = glyph_maps[0].image_format
-		last_id = 0
-		for gmap in glyph_maps[1:-1]:
-			if last_glyph + 1 != gmap.glyph or last_image_format != gmap.image_format:
-				headers.extend (struct.pack(">HHL", start, last_glyph, headersLen + len (subtables)))
-				self.push_stream (subtables)
-				self.write_indexSubTable1 (glyph_maps[start_id:last_id+2])
-				self.pop_stream ()
-
-				start = gmap.glyph
-				start_id = last_id + 1
-			last_glyph = gmap.glyph
-			last_image_format = gmap.image_format
-			last_id += 1
-		headers.extend (struct.pack(">HHL", start, last_glyph, headersLen + len (subtables)))
-		self.push_stream (subtables)
-		self.write_indexSubTable1 (glyph_maps[start_id:last_id+2])
-		self.pop_stream ()
+		for index_format, start, end in runs:
+			headers.extend (struct.pack(">HHL", glyph_maps[start].glyph, glyph_maps[end - 1].glyph,
+						    headersLen + len (subtables)))
+			self.push_stream (subtables)
+			self.write_indexSubTable (index_format, glyph_maps[start:end])
+			self.pop_stream ()
 
 		indexTablesSize = len (headers) + len (subtables)
-		numberOfIndexSubTables = count
+		numberOfIndexSubTables = len (runs)
+		self.index_size = indexTablesSize
 		bitmapSizeTableSize = 48 * self.num_strikes
 
 		indexSubTableArrayOffset = 8 + bitmapSizeTableSize + len (self.otherTables)
@@ -385,9 +684,189 @@ class CBLC:
 		self.pop_stream ()
 
 
+def is_vs (cp):
+	return cp >= 0xfe00 and cp <= 0xfe0f
+
+
+def image_file_chars (img_file, img_prefix):
+	"""Return the character string for an image file named img_prefix
+	followed by hex codepoints, without variation selectors, or None for a
+	lone variation selector."""
+	codes = img_file[len (img_prefix):-4]
+	if "_" in codes:
+		pieces = codes.split ("_")
+		cps = [int(code, 16) for code in pieces]
+		return "".join (unichr(cp) for cp in cps if not is_vs(cp))
+	cp = int(codes, 16)
+	if is_vs(cp):
+		print("ignoring unexpected vs input %04x" % cp)
+		return None
+	return unichr(cp)
+
+
+def collect_strike_images (img_prefix):
+	"""Return a mapping from character strings to the image files named
+	img_prefix followed by hex codepoints, separated by underscore if there
+	is more than one.  Variation selectors are dropped from the strings."""
+	img_files = {}
+	glb = "%s*.png" % img_prefix
+	print("Looking for images matching '%s'." % glb)
+	for img_file in glob.glob (glb):
+		uchars = image_file_chars (img_file, img_prefix)
+		if uchars:
+			img_files[uchars] = img_file
+	if not img_files:
+		raise Exception ("No image files found in '%s'." % glb)
+	print("Found images for %d characters in '%s'." % (len (img_files), glb))
+	return img_files
+
+
+class GlyphResolver:
+	"""Maps character strings to (glyph name, glyph id) in a font.  Results
+	are remembered, so characters shared by several strikes are only looked
+	up once."""
+
+	def __init__ (self, font):
+		unicode_cmap = font['cmap'].getcmap (3, 10)
+		if not unicode_cmap:
+			unicode_cmap = font['cmap'].getcmap (3, 1)
+		if not unicode_cmap:
+			raise Exception ("Failed to find a Unicode cmap.")
+		self.font = font
+		self.cmap = unicode_cmap.cmap
+		self.ligature_index = LigatureIndex (font, self.cmap)
+		self.resolved = {}
+
+	def resolve (self, uchars):
+		try:
+			return self.resolved[uchars]
+		except KeyError:
+			pass
+		if len (uchars) == 1:
+			try:
+				glyph_name = self.cmap[ord (uchars)]
+			except:
+				print("no cmap entry for %x" % ord(uchars))
+				raise ValueError("%x" % ord(uchars))
+		else:
+			glyph_name = self.ligature_index.glyph_for_sequence (uchars)
+			if glyph_name is None:
+				raise ValueError ("no ligature for %s" % "_".join ("%04x" % ord (char) for char in uchars))
+		result = (glyph_name, self.font.getGlyphID (glyph_name))
+		self.resolved[uchars] = result
+		return result
+
+
+def add_font_table (font, tag, data):
+	tab = ttLib.tables.DefaultTable.DefaultTable (tag)
+	tab.data = data
+	font[tag] = tab
+
+
+def drop_outline_tables (font):
+	for tag in ['cvt ', 'fpgm', 'glyf', 'loca', 'prep', 'CFF ', 'VORG']:
+		try:
+			del font[tag]
+		except KeyError:
+			pass
+
+
+def add_strikes (font, img_prefixes, options = (), png_index = None, records = None, cbdt_file = None):
+	"""Build CBDT and CBLC tables with one strike per image prefix, in the
+	order given, and add them to font.  All strikes are written in a single
+	pass and share one character to glyph mapping.  If records is a dict, the
+	filtered PNG data is taken from and added to it, so it can be shared with
+	later calls that use the same keep_chunks option.
+
+	If cbdt_file is given, the CBDT table is written to that binary file
+	instead of being kept in memory, and font only gets a placeholder for
+	it.  Save the font with font_splice.save_with_table then."""
+
+	font_metrics = FontMetrics (font['head'].unitsPerEm,
+				    font['hhea'].ascent,
+				    -font['hhea'].descent)
+	print("Font metrics: upem=%d ascent=%d descent=%d." % \
+	      (font_metrics.upem, font_metrics.ascent, font_metrics.descent))
+	glyph_metrics = font['hmtx'].metrics
+	resolver = GlyphResolver (font)
+
+	image_format = 1 if 'uncompressed' in options else (17
+		if 'small_glyph_metrics' in options else 18)
+
+	if png_index is None:
+		png_index = PNGIndex ()
+	stream = FileStream (cbdt_file) if cbdt_file != None else None
+	ebdt = CBDT (font_metrics, options, stream, png_index, records)
+	ebdt.write_header ()
+	eblc = CBLC (font_metrics, options)
+	eblc.write_header ()
+	eblc.start_strikes (len (img_prefixes))
+	index_saved = 0
+
+	for img_prefix in img_prefixes:
+		print()
+		start_time = time.time ()
+
+		img_files = collect_strike_images (img_prefix)
+
+		glyph_imgs = {}
+		advance = width = height = 0
+		for uchars, img_file in img_files.items ():
+			glyph_name, glyph_id = resolver.resolve (uchars)
+			glyph_imgs[glyph_id] = img_file
+			if "verbose" in options:
+				uchars_name = ",".join (["%04X" % ord (char) for char in uchars])
+				# print "Matched U+%s: id=%d name=%s image=%s" % (
+				#    uchars_name, glyph_id, glyph_name, img_file)
+
+			advance += glyph_metrics[glyph_name][0]
+			w, h = png_index.get_size (img_file)
+			width += w
+			height += h
+
+		glyphs = sorted (glyph_imgs.keys ())
+		if not glyphs:
+			raise Exception ("No common characters found between font and '%s*.png'." % img_prefix)
+		print("Embedding images for %d glyphs for this strike." % len (glyphs))
+
+		advance, width, height = (div (x, len (glyphs)) for x in (advance, width, height))
+		strike_metrics = StrikeMetrics (font_metrics, advance, width, height)
+		print("Strike ppem set to %d." % (strike_metrics.y_ppem))
+
+		ebdt_start = ebdt.tell ()
+		eblc_start = len (eblc.otherTables)
+
+		ebdt.start_strike (strike_metrics)
+		ebdt.write_glyphs (glyphs, glyph_imgs, image_format)
+		glyph_maps = ebdt.end_strike ()
+
+		eblc.write_strike (strike_metrics, glyph_maps)
+
+		print("Strike %d: %d bytes of CBDT image data, %d bytes of CBLC index data, %.2fs." % (
+			strike_metrics.y_ppem, ebdt.tell () - ebdt_start,
+			len (eblc.otherTables) - eblc_start + 48, time.time () - start_time))
+		index_saved += eblc.index_format1_size - eblc.index_size
+
+	print()
+
+	ebdt_dedup_saved = ebdt.dedup_saved
+	ebdt = ebdt.data ()
+	if cbdt_file != None:
+		add_placeholder_table (font, 'CBDT')
+	else:
+		add_font_table (font, 'CBDT', ebdt)
+	print("CBDT table synthesized: %d bytes." % len (ebdt))
+	if 'dedup' in options:
+		print("Shared image data of identical bitmaps: %d bytes saved." % ebdt_dedup_saved)
+	eblc.end_strikes ()
+	eblc = eblc.data ()
+	add_font_table (font, 'CBLC', eblc)
+	print("CBLC table synthesized: %d bytes, %d bytes smaller than with index format 1 only." % (
+		len (eblc), index_saved))
+
+
 def main (argv):
-	import glob
-	from fontTools import ttx, ttLib
+	from fontTools import ttx
 
 	options = []
 
@@ -397,6 +876,9 @@ def main (argv):
 		"-U": "uncompressed",
                 "-S": "small_glyph_metrics",
 		"-C": "keep_chunks",
+		"-P": "parallel",
+		"-F": "index_format_1",
+		"-D": "dedup",
 	}
 
 	for key, value in option_map.items ():
@@ -404,11 +886,17 @@ def main (argv):
 			options.append (value)
 			argv.remove (key)
 
+	index_file = None
+	if "-I" in argv:
+		i = argv.index ("-I")
+		index_file = argv[i + 1]
+		del argv[i:i + 2]
+
 	if len (argv) < 4:
 		print("""
 Usage:
 
-emoji_builder.py [-V] [-O] [-U] [-S] [-A] font.ttf out-font.ttf strike-prefix...
+emoji_builder.py [-V] [-O] [-U] [-S] [-C] [-P] [-F] [-D] [-I index.json] font.ttf out-font.ttf strike-prefix...
 
 This will search for files that have strike-prefix followed
 by a hex number, and end in ".png".  For example, if strike-prefix
@@ -417,7 +905,10 @@ be loaded.  All images for the same strike should have the same size
 for best results.
 
 If multiple strike-prefix parameters are provided, multiple
-strikes will be embedded, in the order provided.
+strikes will be embedded, in the order provided, e.g. png/72/emoji_u
+png/128/emoji_u.  Characters are mapped to glyphs once and the mapping
+is shared by all strikes.  The size and build time of each strike is
+reported.
 
 The script then embeds color bitmaps in the font, for characters
 that the font already supports, and writes the new font out.
@@ -437,6 +928,21 @@ By default they are dropped.
 If -C is given, unused chunks (color profile, etc) are NOT
 dropped from the PNG images when embedding.
 By default they are dropped.
+
+If -P is given, the PNG images are loaded and filtered, or decoded for -U,
+by a pool of worker processes.  The output is identical to the serial
+build.
+
+If -I is given, the PNG header and chunk layout of each image is kept in
+the named index file, and images that have not changed since a previous
+build are not parsed again.
+
+By default each range of glyphs in the CBLC index gets the smallest index
+subtable format (1, 3 or 4) that can hold it.  If -F is given, only index
+format 1 is used, as older builds did.
+
+If -D is given, glyphs with identical PNG images, such as aliases and
+omitted flags, share one copy of the image data in the strike.
 """, file=sys.stderr)
 		sys.exit (1)
 
@@ -445,130 +951,29 @@ By default they are dropped.
 	img_prefixes = argv[3:]
 	del argv
 
-	def add_font_table (font, tag, data):
-		tab = ttLib.tables.DefaultTable.DefaultTable (tag)
-		tab.data = data
-		font[tag] = tab
-
-	def drop_outline_tables (font):
-		for tag in ['cvt ', 'fpgm', 'glyf', 'loca', 'prep', 'CFF ', 'VORG']:
-			try:
-				del font[tag]
-			except KeyError:
-				pass
-
-
 	print()
 
 	font = ttx.TTFont (font_file)
 	print("Loaded font '%s'." % font_file)
 
-	font_metrics = FontMetrics (font['head'].unitsPerEm,
-				    font['hhea'].ascent,
-				    -font['hhea'].descent)
-	print("Font metrics: upem=%d ascent=%d descent=%d." % \
-	      (font_metrics.upem, font_metrics.ascent, font_metrics.descent))
-	glyph_metrics = font['hmtx'].metrics
-	unicode_cmap = font['cmap'].getcmap (3, 10)
-	if not unicode_cmap:
-		unicode_cmap = font['cmap'].getcmap (3, 1)
-	if not unicode_cmap:
-		raise Exception ("Failed to find a Unicode cmap.")
-
-	image_format = 1 if 'uncompressed' in options else (17
-                if 'small_glyph_metrics' in options else 18)
-
-	ebdt = CBDT (font_metrics, options)
-	ebdt.write_header ()
-	eblc = CBLC (font_metrics, options)
-	eblc.write_header ()
-	eblc.start_strikes (len (img_prefixes))
-
-	def is_vs(cp):
-                return cp >= 0xfe00 and cp <= 0xfe0f
+	png_index = PNGIndex (index_file)
+	# The CBDT table is streamed to a temporary file and copied into the
+	# output font from there, so it is never held in memory.
+	with tempfile.TemporaryFile (dir = path.dirname (path.abspath (out_file))) as cbdt_file:
+		add_strikes (font, img_prefixes, options, png_index, cbdt_file = cbdt_file)
+		png_index.save ()
 
-	for img_prefix in img_prefixes:
 		print()
 
-		img_files = {}
-		glb = "%s*.png" % img_prefix
-		print("Looking for images matching '%s'." % glb)
-		for img_file in glob.glob (glb):
-			codes = img_file[len (img_prefix):-4]
-			if "_" in codes:
-				pieces = codes.split ("_")
-				cps = [int(code, 16) for code in pieces]
-				uchars = "".join (unichr(cp) for cp in cps if not is_vs(cp))
-			else:
-				cp = int(codes, 16)
-				if is_vs(cp):
-				        print("ignoring unexpected vs input %04x" % cp)
-				        continue
-				uchars = unichr(cp)
-			img_files[uchars] = img_file
-		if not img_files:
-			raise Exception ("No image files found in '%s'." % glb)
-		print("Found images for %d characters in '%s'." % (len (img_files), glb))
-
-		glyph_imgs = {}
-		advance = width = height = 0
-		for uchars, img_file in img_files.items ():
-			if len (uchars) == 1:
-                                try:
-                                        glyph_name = unicode_cmap.cmap[ord (uchars)]
-                                except:
-                                        print("no cmap entry for %x" % ord(uchars))
-                                        raise ValueError("%x" % ord(uchars))
-			else:
-				glyph_name = get_glyph_name_from_gsub (uchars, font, unicode_cmap.cmap)
-			glyph_id = font.getGlyphID (glyph_name)
-			glyph_imgs[glyph_id] = img_file
-			if "verbose" in options:
-				uchars_name = ",".join (["%04X" % ord (char) for char in uchars])
-				# print "Matched U+%s: id=%d name=%s image=%s" % (
-                                #    uchars_name, glyph_id, glyph_name, img_file)
-
-			advance += glyph_metrics[glyph_name][0]
-			w, h = PNG (img_file).get_size ()
-			width += w
-			height += h
-
-		glyphs = sorted (glyph_imgs.keys ())
-		if not glyphs:
-			raise Exception ("No common characters found between font and '%s'." % glb)
-		print("Embedding images for %d glyphs for this strike." % len (glyphs))
-
-		advance, width, height = (div (x, len (glyphs)) for x in (advance, width, height))
-		strike_metrics = StrikeMetrics (font_metrics, advance, width, height)
-		print("Strike ppem set to %d." % (strike_metrics.y_ppem))
-
-		ebdt.start_strike (strike_metrics)
-		ebdt.write_glyphs (glyphs, glyph_imgs, image_format)
-		glyph_maps = ebdt.end_strike ()
-
-		eblc.write_strike (strike_metrics, glyph_maps)
-
-	print()
-
-	ebdt = ebdt.data ()
-	add_font_table (font, 'CBDT', ebdt)
-	print("CBDT table synthesized: %d bytes." % len (ebdt))
-	eblc.end_strikes ()
-	eblc = eblc.data ()
-	add_font_table (font, 'CBLC', eblc)
-	print("CBLC table synthesized: %d bytes." % len (eblc))
-
-	print()
-
-	if 'keep_outlines' not in options:
-		drop_outline_tables (font)
-		print("Dropped outline ('glyf', 'CFF ') and related tables.")
+		if 'keep_outlines' not in options:
+			drop_outline_tables (font)
+			print("Dropped outline ('glyf', 'CFF ') and related tables.")
 
-        # hack removal of cmap pua entry for unknown flag glyph.  If we try to
-        # remove it earlier, getGlyphID dies.  Need to restructure all of this
-        # code.
-	font_data.delete_from_cmap(font, [0xfe82b])
-	font.save (out_file)
+	        # hack removal of cmap pua entry for unknown flag glyph.  If we try to
+	        # remove it earlier, getGlyphID dies.  Need to restructure all of this
+	        # code.
+		font_data.delete_from_cmap(font, [0xfe82b])
+		save_with_table (font, 'CBDT', cbdt_file, out_file)
 	print("Output font '%s' generated." % out_file)
 
 
@@ -0,0 +1,118 @@
+"""Save a font with one table's data taken from a file.
+
+A table like CBDT can be far larger than the rest of the font together.
+Rather than handing it to fontTools, which keeps its own copy until the font
+is written, the font is saved with a placeholder for the table, and the
+table is then copied into the output from a file in fixed size blocks.  The
+table directory, table checksums and head checkSumAdjustment are updated to
+match."""
+
+import io
+import struct
+
+from fontTools.ttLib import tables
+from fontTools.ttLib.sfnt import calcChecksum
+
+# a multiple of 4, so checksums can be accumulated block by block
+BLOCK_SIZE = 1 << 20
+
+
+class FileStream:
+	"""Stands in for the bytearray a CBDT or CBLC writer appends to, but
+	writes the data to a file and only keeps track of its length."""
+
+	def __init__ (self, f):
+		self.f = f
+		self.length = 0
+
+	def extend (self, data):
+		self.f.write (data)
+		self.length += len (data)
+
+	def __len__ (self):
+		return self.length
+
+
+def add_placeholder_table (font, tag):
+	tab = tables.DefaultTable.DefaultTable (tag)
+	tab.data = b""
+	font[tag] = tab
+
+
+def file_checksum (f, length):
+	f.seek (0)
+	checksum = 0
+	remaining = length
+	while remaining:
+		block = f.read (min (BLOCK_SIZE, remaining))
+		if not block:
+			raise ValueError ("table file is shorter than %d bytes" % length)
+		# blocks are a multiple of 4 bytes, so their checksums add up
+		checksum = (checksum + calcChecksum (block)) & 0xFFFFFFFF
+		remaining -= len (block)
+	return checksum
+
+
+def save_with_table (font, tag, table_file, out_file):
+	"""Save font to out_file with the data of table tag read from the open
+	binary file table_file.  The font must have a placeholder for the table,
+	see add_placeholder_table."""
+
+	table_length = table_file.seek (0, io.SEEK_END)
+
+	buf = io.BytesIO ()
+	font.save (buf)
+	data = buf.getvalue ()
+	sfnt_version, num_tables = struct.unpack_from (">LH", data, 0)
+	header_size = 12 + 16 * num_tables
+
+	entries = []
+	for i in range (num_tables):
+		entries.append (list (struct.unpack_from (">4sLLL", data, 12 + 16 * i)))
+	tag = tag.encode ("latin-1") if isinstance (tag, str) else tag
+	if tag not in [entry[0] for entry in entries]:
+		raise ValueError ("font has no %s table" % tag.decode ("latin-1"))
+
+	# Lay the tables out in the order fontTools wrote them, each padded to 4
+	# bytes, with the new length for the spliced table.
+	sources = {}
+	offset = header_size
+	for entry in sorted (entries, key = lambda entry: entry[2]):
+		entry_tag, checksum, old_offset, length = entry
+		if entry_tag == tag:
+			entry[1] = file_checksum (table_file, table_length)
+			entry[3] = length = table_length
+		else:
+			sources[entry_tag] = data[old_offset:old_offset + length]
+		entry[2] = offset
+		offset += (length + 3) & ~3
+
+	header = bytearray (data[:12])
+	for entry in entries:
+		header.extend (struct.pack (">4sLLL", *entry))
+
+	# The head checksum in the directory is computed without
+	# checkSumAdjustment, so the whole font sums to the checksums of the
+	# directory and of all the tables.
+	head = bytearray (sources[b"head"])
+	head[8:12] = b"\0\0\0\0"
+	total = calcChecksum (bytes (header))
+	for entry in entries:
+		total = (total + entry[1]) & 0xFFFFFFFF
+	struct.pack_into (">L", head, 8, (0xB1B0AFBA - total) & 0xFFFFFFFF)
+	sources[b"head"] = bytes (head)
+
+	with open (out_file, "wb") as out:
+		out.write (header)
+		for entry in sorted (entries, key = lambda entry: entry[2]):
+			entry_tag, _, _, length = entry
+			if entry_tag == tag:
+				table_file.seek (0)
+				remaining = length
+				while remaining:
+					block = table_file.read (min (BLOCK_SIZE, remaining))
+					out.write (block)
+					remaining -= len (block)
+			else:
+				out.write (sources[entry_tag])
+			out.write (b"\0" * (-length % 4))
@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+
+"""Replace the bitmaps of individual glyphs in a font built by emoji_builder.
+
+The CBLC table is read back into the strikes and glyph maps emoji_builder
+wrote it from.  The CBDT table is then written again with the image data of
+the changed glyphs replaced and all other image data copied unchanged, and
+the CBLC offsets are recomputed.  The result is the same as building the
+font again from the updated images, as long as the strike metrics, which
+come from the average image size, do not change."""
+
+from __future__ import print_function
+import struct
+import sys
+from os import path
+
+from fontTools import ttx
+
+import emoji_builder
+from emoji_builder import CBDT, CBLC, FontMetrics, GlyphMap, GlyphResolver, StrikeMetrics
+from png_index import PNGIndex
+
+
+class Strike:
+	def __init__ (self, ppem, width, glyph_maps, blobs):
+		self.ppem = ppem
+		self.width = width # widthMax of the horizontal line metrics
+		self.glyph_maps = glyph_maps # ends with the sentinel, as from CBDT
+		self.blobs = blobs # (start, end) of each glyph's image data
+
+
+def read_strikes (cblc):
+	"""Return the strikes of a CBLC table, given as bytes.  Index subtable
+	formats 1, 3 and 4, the ones emoji_builder writes, are supported."""
+	version, num_strikes = struct.unpack_from (">LL", cblc, 0)
+	strikes = []
+	for i in range (num_strikes):
+		offset = 8 + 48 * i
+		array_offset, _, num_subtables = struct.unpack_from (">LLL", cblc, offset)
+		width = struct.unpack_from (">B", cblc, offset + 18)[0]
+		ppem = struct.unpack_from (">B", cblc, offset + 45)[0]
+
+		glyph_maps = []
+		blobs = []
+		for j in range (num_subtables):
+			first, last, additional = struct.unpack_from (">HHL", cblc, array_offset + 8 * j)
+			subtable = array_offset + additional
+			index_format, image_format, image_offset = struct.unpack_from (">HHL", cblc, subtable)
+			if index_format in (1, 3):
+				count = last - first + 1
+				offsets = struct.unpack_from (">%d%s" % (count + 1, "L" if index_format == 1 else "H"),
+							      cblc, subtable + 8)
+				glyphs = range (first, last + 1)
+			elif index_format == 4:
+				count = struct.unpack_from (">L", cblc, subtable + 8)[0]
+				pairs = struct.unpack_from (">%dH" % (2 * (count + 1)), cblc, subtable + 12)
+				glyphs = pairs[0:-2:2]
+				offsets = pairs[1::2]
+			else:
+				raise ValueError ("index subtable format %d is not supported" % index_format)
+			for k, glyph in enumerate (glyphs):
+				# glyphs without an image have a zero length entry
+				if offsets[k] == offsets[k + 1]:
+					continue
+				glyph_maps.append (GlyphMap (glyph, image_offset + offsets[k], image_format,
+							     offsets[k + 1] - offsets[k]))
+				blobs.append ((image_offset + offsets[k], image_offset + offsets[k + 1]))
+		glyph_maps.append (GlyphMap (None, blobs[-1][1], None))
+		strikes.append (Strike (ppem, width, glyph_maps, blobs))
+	return strikes
+
+
+def patch_strikes (font, img_files, options = (), png_index = None, ppem = None):
+	"""Replace the bitmaps of the glyphs for img_files, a mapping from
+	character strings to image files, in the strike with the given ppem, or
+	in the only strike of the font."""
+
+	font_metrics = FontMetrics (font['head'].unitsPerEm,
+				    font['hhea'].ascent,
+				    -font['hhea'].descent)
+	cbdt_data = font.getTableData ('CBDT')
+	strikes = read_strikes (font.getTableData ('CBLC'))
+	if ppem == None:
+		if len (strikes) != 1:
+			raise ValueError ("font has %d strikes, give the ppem of the one to patch" % len (strikes))
+		ppem = strikes[0].ppem
+	if ppem not in [strike.ppem for strike in strikes]:
+		raise ValueError ("font has no strike with ppem %d" % ppem)
+
+	resolver = GlyphResolver (font)
+	changed = {}
+	for uchars, img_file in img_files.items ():
+		glyph_name, glyph_id = resolver.resolve (uchars)
+		changed[glyph_id] = img_file
+
+	if png_index == None:
+		png_index = PNGIndex ()
+	ebdt = CBDT (font_metrics, options, png_index = png_index)
+	ebdt.write_header ()
+	eblc = CBLC (font_metrics, options)
+	eblc.write_header ()
+	eblc.start_strikes (len (strikes))
+
+	for strike in strikes:
+		strike_metrics = StrikeMetrics (font_metrics, None, strike.width, None, ppem = strike.ppem)
+		patch = changed if strike.ppem == ppem else {}
+		missing = set (patch) - set (gmap.glyph for gmap in strike.glyph_maps)
+		if missing:
+			raise ValueError ("glyphs %s have no bitmap in strike %d, rebuild the font instead" % (
+				", ".join (font.getGlyphName (glyph) for glyph in sorted (missing)), ppem))
+
+		ebdt.start_strike (strike_metrics)
+		for gmap, (start, end) in zip (strike.glyph_maps, strike.blobs):
+			if gmap.glyph in patch:
+				if gmap.image_format not in (17, 18):
+					raise ValueError ("can only patch PNG bitmaps, not image format %d" % gmap.image_format)
+				img_file = patch[gmap.glyph]
+				width, height, png_data = emoji_builder.load_png_record (
+					img_file, png_index.info (img_file), 'keep_chunks' in options)
+				ebdt.add_glyph (gmap.glyph, gmap.image_format, None, ebdt.write_png_record,
+						width, height, png_data, gmap.image_format == 18)
+			else:
+				# glyphs that shared image data still do
+				ebdt.add_glyph (gmap.glyph, gmap.image_format, (start, end), ebdt.write,
+						cbdt_data[start:end])
+		eblc.write_strike (strike_metrics, ebdt.end_strike ())
+		if patch:
+			print("Strike %d: replaced %d of %d bitmaps." % (
+				strike.ppem, len (patch), len (strike.blobs)))
+
+	emoji_builder.add_font_table (font, 'CBDT', ebdt.data ())
+	eblc.end_strikes ()
+	emoji_builder.add_font_table (font, 'CBLC', eblc.data ())
+
+
+def main (argv):
+
+	options = []
+	if "-C" in argv:
+		options.append ("keep_chunks")
+		argv.remove ("-C")
+
+	flags = {"-I": None, "-s": None, "-p": "emoji_u"}
+	for flag in flags:
+		if flag in argv:
+			i = argv.index (flag)
+			flags[flag] = argv[i + 1]
+			del argv[i:i + 2]
+
+	if len (argv) < 4:
+		print("""
+Usage:
+
+patch_cbdt.py [-C] [-I index.json] [-s ppem] [-p prefix] font.ttf out-font.ttf image.png...
+
+This replaces the bitmaps of the glyphs for the given images in a font built
+by emoji_builder.py, and leaves all other bitmaps alone.  Image files are
+named as for emoji_builder.py, prefix (default "emoji_u") followed by hex
+codepoints.  Only glyphs that already have a bitmap can be patched.
+
+If -C is given, unused chunks are NOT dropped from the new PNG images, which
+should match how the font was built.
+
+If -s is given, the strike with that ppem is patched.  By default the font
+must have a single strike.
+
+If -I is given, the PNG header and chunk layout of each image is kept in
+the named index file, as for emoji_builder.py.
+""", file=sys.stderr)
+		sys.exit (1)
+
+	font_file = argv[1]
+	out_file = argv[2]
+	img_files = {}
+	for img_file in argv[3:]:
+		name = path.basename (img_file)
+		if not name.startswith (flags["-p"]) or not name.endswith (".png"):
+			raise ValueError ("%s is not named %s<codepoints>.png" % (img_file, flags["-p"]))
+		uchars = emoji_builder.image_file_chars (name, flags["-p"])
+		if uchars:
+			img_files[uchars] = img_file
+
+	font = ttx.TTFont (font_file)
+	png_index = PNGIndex (flags["-I"])
+	ppem = int (flags["-s"]) if flags["-s"] else None
+	patch_strikes (font, img_files, options, png_index, ppem)
+	png_index.save ()
+	font.save (out_file)
+	print("Output font '%s' generated." % out_file)
+
+
+if __name__ == '__main__':
+	main (sys.argv)
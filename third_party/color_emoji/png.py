@@ -17,6 +17,7 @@
 # Google Author(s): Behdad Esfahbod
 #
 
+import mmap
 import struct
 import sys
 from io import BytesIO
@@ -34,12 +35,23 @@ class PNG:
 
 	def __init__ (self, f):
 
-		if isinstance(f, basestring):
+		self.owns_file = isinstance(f, basestring)
+		if self.owns_file:
 			f = open (f, 'rb')
 
 		self.f = f
 		self.IHDR = None
 
+	def close (self):
+		if self.owns_file:
+			self.f.close ()
+
+	def __enter__ (self):
+		return self
+
+	def __exit__ (self, *exc_info):
+		self.close ()
+
 	def tell (self):
 		return self.f.tell ()
 
@@ -114,3 +126,52 @@ class PNG:
 			if chunk_type == b"IEND":
 				break
 		return PNG (out)
+
+
+class MappedPNG (PNG):
+	"""A PNG backed by a read-only memory map of the file.  data () and
+	chunks () return memoryview slices of the map instead of copies, so the
+	image data can be written straight to its destination.  Close it (or use
+	it as a context manager) once the slices are no longer needed."""
+
+	def __init__ (self, f):
+
+		self.owns_file = isinstance(f, basestring)
+		if self.owns_file:
+			f = open (f, 'rb')
+
+		self.file = f
+		# mmap supports read/seek/tell, so the PNG chunk reading methods
+		# work unchanged on top of it.
+		self.f = mmap.mmap (f.fileno (), 0, access = mmap.ACCESS_READ)
+		self.view = memoryview (self.f)
+		self.IHDR = None
+
+	def close (self):
+		self.view.release ()
+		self.f.close ()
+		if self.owns_file:
+			self.file.close ()
+
+	def data (self):
+		return self.view
+
+	def chunks (self, chunks = None):
+		"""Yield (chunk_type, view) for each chunk up to and including IEND,
+		where view covers the whole chunk including its length and crc.  If
+		chunks is given, only chunks with those types are returned."""
+		pos = len (PNG.signature)
+		if self.view[:pos] != PNG.signature:
+			raise PNG.BadSignature
+		while True:
+			if pos + 8 > len (self.view):
+				raise PNG.BadChunk
+			length, chunk_type = struct.unpack_from (">I4s", self.f, pos)
+			end = pos + 12 + length
+			if end > len (self.view):
+				raise PNG.BadChunk
+			if chunks is None or chunk_type in chunks:
+				yield chunk_type, self.view[pos:end]
+			if chunk_type == b"IEND":
+				break
+			pos = end
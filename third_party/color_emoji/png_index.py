@@ -0,0 +1,101 @@
+"""Index of PNG header data and chunk layout, optionally kept on disk.
+
+Entries are keyed by path and remember the file's mtime and size, so a file
+is only parsed again when it changes.  Each entry records the image size,
+color type and the byte range of every chunk, which is enough to produce the
+chunk-filtered image data without parsing the file again."""
+
+import collections
+import json
+import os
+
+from png import PNG
+
+
+class PNGInfo (collections.namedtuple ("PNGInfo",
+				       "width height color_type chunks")):
+	"""chunks is a tuple of (chunk_type, start, end) byte ranges, each
+	covering a whole chunk including its length, type and crc."""
+
+	__slots__ = ()
+
+	def filter (self, data, chunks):
+		"""Return the PNG data with only the chunks whose type is in chunks."""
+		out = bytearray (PNG.signature)
+		for chunk_type, start, end in self.chunks:
+			if chunk_type in chunks:
+				out.extend (data[start:end])
+		return out
+
+
+def read_png_info (f):
+	png = PNG (f)
+	width, height, bit_depth, color_type = png.read_header ()[:4]
+	png.seek (len (PNG.signature))
+	chunks = []
+	while True:
+		start = png.tell ()
+		chunk_type = png.read_chunk ()[0]
+		chunks.append ((chunk_type, start, png.tell ()))
+		if chunk_type == b"IEND":
+			break
+	return PNGInfo (width, height, color_type, tuple (chunks))
+
+
+class PNGIndex:
+
+	version = 1
+
+	def __init__ (self, index_file = None):
+		self.index_file = index_file
+		self.entries = {}
+		self.checked = {}
+		self.dirty = False
+		if index_file and os.path.exists (index_file):
+			with open (index_file) as f:
+				data = json.load (f)
+			if data.get ("version") == self.version:
+				self.entries = data["entries"]
+
+	def info (self, filename):
+		"""Return the PNGInfo for filename, parsing it only if it is not in
+		the index or has changed since it was indexed.  Files are assumed not
+		to change again once they have been looked up."""
+		key = os.path.abspath (filename)
+		info = self.checked.get (key)
+		if info:
+			return info
+
+		st = os.stat (filename)
+		entry = self.entries.get (key)
+		if entry and entry["mtime"] == st.st_mtime_ns and entry["size"] == st.st_size:
+			info = PNGInfo (entry["width"], entry["height"], entry["color_type"],
+					tuple ((chunk_type.encode ("latin-1"), start, end)
+					       for chunk_type, start, end in entry["chunks"]))
+		else:
+			with open (filename, "rb") as f:
+				info = read_png_info (f)
+			self.entries[key] = {
+				"mtime": st.st_mtime_ns,
+				"size": st.st_size,
+				"width": info.width,
+				"height": info.height,
+				"color_type": info.color_type,
+				"chunks": [(chunk_type.decode ("latin-1"), start, end)
+					   for chunk_type, start, end in info.chunks],
+			}
+			self.dirty = True
+		self.checked[key] = info
+		return info
+
+	def get_size (self, filename):
+		return self.info (filename)[0:2]
+
+	def save (self):
+		if not self.index_file or not self.dirty:
+			return
+		tmp_file = "%s.%d.tmp" % (self.index_file, os.getpid ())
+		with open (tmp_file, "w") as f:
+			json.dump ({"version": self.version, "entries": self.entries}, f)
+		os.replace (tmp_file, self.index_file)
+		self.dirty = False
@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+
+"""A snapshot of the nototools emoji data, for fast tool startup.
+
+nototools.unicode_data parses the UCD and emoji text files the first time
+they are needed, which takes about two seconds, and age() loads the whole
+UCD even when only emoji are asked about.  This module keeps the parsed
+emoji tables (emoji sets, sequences with their names and ages, canonical
+sequences, groups and sort order) together with the ages and names of the
+emoji code points in a pickle, written by running it as a command:
+
+  unicode_snapshot.py [-o FILE]
+
+Importing it loads the snapshot and primes the nototools caches with it.
+The tools use it in place of nototools.unicode_data; everything it does
+not define itself is looked up in nototools.  When the snapshot is
+missing, or was written from other nototools data, it is ignored and
+nototools parses the text files as before."""
+
+import argparse
+import os
+from os import path
+import pickle
+import sys
+import unicodedata
+
+from nototools import unicode_data as _unicode_data
+
+
+SNAPSHOT_FILE = os.environ.get(
+    "UNICODE_SNAPSHOT",
+    path.join(path.dirname(path.abspath(__file__)), "build", "unicode_snapshot.pickle"),
+)
+
+# Bump this when the snapshot contents change.
+_SNAPSHOT_VERSION = 1
+
+# The nototools module globals stored in the snapshot.  Each of them is the
+# guard of a nototools loader, so once they are set the text files are not
+# read again.
+_EMOJI_GLOBALS = (
+    "_presentation_default_emoji",
+    "_presentation_default_text",
+    "_emoji_modifier_base",
+    "_emoji",
+    "_emoji_variants",
+    "_emoji_variants_proposed",
+    "_emoji_sequence_data",
+    "_emoji_non_vs_to_canonical",
+    "_emoji_group_data",
+)
+
+# set by load()
+_ages = None
+_names = None
+_sequence_names = None
+
+
+def _source_key():
+    """Identify the nototools code and data the snapshot is made from."""
+    data_dir = _unicode_data._DATA_DIR_PATH
+    files = [_unicode_data.__file__] + [
+        path.join(data_dir, f) for f in sorted(os.listdir(data_dir))
+    ]
+    stats = []
+    for f in files:
+        st = os.stat(f)
+        stats.append((path.basename(f), st.st_size, st.st_mtime_ns))
+    return (
+        _SNAPSHOT_VERSION,
+        _unicode_data.UNICODE_VERSION,
+        unicodedata.unidata_version,
+        tuple(stats),
+    )
+
+
+def _emoji_cps():
+    cps = set(_unicode_data.get_emoji())
+    cps |= _unicode_data.proposed_emoji_cps()
+    for seq in _unicode_data.get_emoji_sequences():
+        cps.update(seq)
+    return cps
+
+
+def build_snapshot():
+    """Load the nototools emoji data and return the snapshot of it."""
+    _unicode_data.load_data()
+    _unicode_data._load_emoji_group_data()
+    cps = _emoji_cps()
+
+    names = {}
+    for cp in cps:
+        try:
+            unicodedata.name(chr(cp))
+        except ValueError:
+            # name() falls back to the nototools data for these
+            names[cp] = _unicode_data.name(cp, None)
+
+    sequence_names = {}
+    for seq, (seq_name, _, _) in _unicode_data._emoji_sequence_data.items():
+        non_vs_seq = _unicode_data.strip_emoji_vs(seq)
+        if len(non_vs_seq) > 1:
+            sequence_names[non_vs_seq] = seq_name
+
+    return {
+        "key": _source_key(),
+        "globals": {name: getattr(_unicode_data, name) for name in _EMOJI_GLOBALS},
+        "proposed_emoji": _unicode_data._proposed_emoji_data,
+        "ages": {cp: _unicode_data.age(cp) for cp in cps},
+        "names": names,
+        "sequence_names": sequence_names,
+    }
+
+
+def write_snapshot(out_file=SNAPSHOT_FILE):
+    snapshot = build_snapshot()
+    out_dir = path.dirname(path.abspath(out_file))
+    os.makedirs(out_dir, exist_ok=True)
+    tmp_file = out_file + ".tmp"
+    with open(tmp_file, "wb") as f:
+        pickle.dump(snapshot, f, pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_file, out_file)
+    return snapshot
+
+
+def load(snapshot_file=SNAPSHOT_FILE):
+    """Prime the nototools emoji data from snapshot_file.  Return False if
+    there is no usable snapshot."""
+    global _ages, _names, _sequence_names
+    try:
+        with open(snapshot_file, "rb") as f:
+            snapshot = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError):
+        return False
+    if not isinstance(snapshot, dict) or snapshot.get("key") != _source_key():
+        return False
+
+    for name, value in snapshot["globals"].items():
+        setattr(_unicode_data, name, value)
+    # An empty dict does not stop nototools from looking for the file again,
+    # but then there is no file to find.
+    _unicode_data._proposed_emoji_data = snapshot["proposed_emoji"]
+    _unicode_data._proposed_emoji_data_cps = frozenset(snapshot["proposed_emoji"])
+    _ages = snapshot["ages"]
+    _names = snapshot["names"]
+    _sequence_names = snapshot["sequence_names"]
+    return True
+
+
+def is_loaded():
+    return _ages is not None
+
+
+def age(char):
+    """Like nototools unicode_data.age, without loading the UCD for emoji."""
+    cp = char if isinstance(char, int) else ord(char)
+    if _ages is not None and cp in _ages:
+        return _ages[cp]
+    return _unicode_data.age(char)
+
+
+def name(char, *args):
+    """Like nototools unicode_data.name, without loading the UCD for emoji."""
+    cp = char if isinstance(char, int) else ord(char)
+    if _names is not None and cp in _ages:
+        try:
+            return unicodedata.name(chr(cp))
+        except ValueError:
+            pass
+        cp_name = _names.get(cp)
+        if cp_name is not None:
+            return cp_name
+        if args:
+            return args[0]
+    return _unicode_data.name(char, *args)
+
+
+def get_sequence_names():
+    """Return a map from the emoji sequences of more than one code point,
+    without emoji variation selectors, to their names."""
+    global _sequence_names
+    if _sequence_names is None:
+        _sequence_names = {}
+        for seq in _unicode_data.get_emoji_sequences():
+            non_vs_seq = _unicode_data.strip_emoji_vs(seq)
+            if len(non_vs_seq) > 1:
+                _sequence_names[non_vs_seq] = _unicode_data.get_emoji_sequence_name(seq)
+    return _sequence_names
+
+
+def __getattr__(attr):
+    return getattr(_unicode_data, attr)
+
+
+load()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Write the snapshot of the nototools emoji data."
+    )
+    parser.add_argument(
+        "-o",
+        "--out_file",
+        help="snapshot file (default %s)" % SNAPSHOT_FILE,
+        metavar="file",
+        default=SNAPSHOT_FILE,
+    )
+    args = parser.parse_args()
+    snapshot = write_snapshot(args.out_file)
+    print(
+        "wrote %d sequences and %d code points to %s"
+        % (len(snapshot["globals"]["_emoji_sequence_data"]), len(snapshot["ages"]),
+           args.out_file),
+        file=sys.stderr,
+    )
+
+
+if __name__ == "__main__":
+    main()